@@ -0,0 +1,176 @@
+# Asynchronous (ASGI) serving mode of the application, e.g.
+#
+#   uvicorn asgi:app
+#
+# The conversion API is served natively: converter() runs in a bounded thread
+# pool, so slow clients only hold a cheap coroutine instead of a worker slot,
+# and at most MAX_PENDING conversions are queued at a time. Every other route
+# is handed to the Flask application, which requires the optional asgiref
+# package.
+
+import asyncio
+import json
+import os
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from coreengine.converter import converter, converter_many
+from coreengine.errors import ConversionError
+from transliterator import (app as flask_app, parse_batch, conversion_options,
+                            conversion_etag, error_details, error_status, is_enabled,
+                            CACHE_CONTROL)
+
+try:
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:
+    WsgiToAsgi = None
+
+CONVERSION_THREADS = int(os.environ.get("CONVERSION_THREADS", 4))
+MAX_PENDING = int(os.environ.get("CONVERSION_MAX_PENDING", 64))
+MAX_BODY_SIZE = int(os.environ.get("CONVERSION_MAX_BODY_SIZE", 4 * 1024 * 1024))
+
+executor = ThreadPoolExecutor(max_workers=CONVERSION_THREADS,
+                              thread_name_prefix="converter")
+pending = asyncio.Semaphore(MAX_PENDING)
+flask_asgi = WsgiToAsgi(flask_app) if WsgiToAsgi is not None else None
+
+
+async def run_in_pool(function, *args, **kwargs):
+    async with pending:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, partial(function, *args, **kwargs))
+
+
+async def send_response(send, status, body=b"", headers=()):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(name.encode("latin-1"), value.encode("latin-1"))
+                    for name, value in headers],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def send_json(send, status, data, headers=()):
+    body = json.dumps(data).encode("utf-8")
+    await send_response(send, status, body,
+                        [("content-type", "application/json")] + list(headers))
+
+
+# The body of the request, or None if it is larger than MAX_BODY_SIZE
+async def read_body(receive):
+    chunks = []
+    size = 0
+    more_body = True
+
+    while more_body:
+        message = await receive()
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > MAX_BODY_SIZE:
+            return None
+        chunks.append(chunk)
+        more_body = message.get("more_body", False)
+
+    return b"".join(chunks)
+
+
+def request_header(scope, name):
+    name = name.encode("latin-1")
+    for key, value in scope.get("headers", []):
+        if key.lower() == name:
+            return value.decode("latin-1")
+    return None
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or any(
+        (tag[2:] if tag.startswith("W/") else tag).strip('"') == etag for tag in tags)
+
+
+# GET /api/convert?text=...&scrivener=1 (or &profile=...), with the same
+# caching headers as the Flask view
+async def convert_cached(scope, send):
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    text = query.get("text", [""])[0]
+    try:
+        options = conversion_options(is_enabled(query.get("scrivener", [""])[0]),
+                                     query.get("format", [""])[0],
+                                     is_enabled(query.get("strict", [""])[0]),
+                                     query.get("profile", [""])[0])
+    except ValueError as error:
+        await send_json(send, 400, error_details(error))
+        return
+    etag = conversion_etag(text, options)
+    headers = [("etag", '"{}"'.format(etag)), ("cache-control", CACHE_CONTROL)]
+
+    if etag_matches(request_header(scope, "if-none-match"), etag):
+        await send_response(send, 304, headers=headers)
+        return
+
+    try:
+        result = await run_in_pool(converter, text, **options)
+    except ConversionError as error:
+        await send_json(send, error_status(error), error_details(error))
+        return
+    body = json.dumps({"text": result[0], "codepoints": result[1]}).encode("utf-8")
+    if scope["method"] == "HEAD":
+        body = b""
+    await send_response(send, 200, body, [("content-type", "application/json")] + headers)
+
+
+# POST /api/convert, the batch conversion
+async def convert_batch(receive, send):
+    body = await read_body(receive)
+    if body is None:
+        await send_json(send, 413, {"error": "Request body is over the limit of {} bytes."
+                                             .format(MAX_BODY_SIZE), "limit": MAX_BODY_SIZE})
+        return
+
+    try:
+        payload = json.loads(body or b"null")
+        texts, options = parse_batch(payload)
+        results = await run_in_pool(converter_many, texts, **options)
+    except ValueError as error:
+        await send_json(send, error_status(error), error_details(error))
+        return
+
+    await send_json(send, 200, [{"text": text, "codepoints": codepoints}
+                                for text, codepoints in results])
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            executor.shutdown(wait=True)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+
+    if scope["type"] == "http" and scope["path"] == "/api/convert":
+        if scope["method"] in ("GET", "HEAD"):
+            await convert_cached(scope, send)
+            return
+        if scope["method"] == "POST":
+            await convert_batch(receive, send)
+            return
+        await send_response(send, 405, headers=[("allow", "GET, HEAD, POST")])
+        return
+
+    if flask_asgi is None:
+        await send_json(send, 404, {"error": "Only /api/convert is served without asgiref."})
+        return
+
+    await flask_asgi(scope, receive, send)
@@ -0,0 +1,126 @@
+# Benchmark of the conversion of single, very long words (i.e. input without
+# any space), from 10 characters up to 1 MB. The cost per character of every
+# stage should stay flat as the words grow; a stage whose cost per character
+# keeps growing with the length is superlinear, and a single long word would
+# be enough to tie up a worker.
+#
+#   python -m benchmarks.bench_long_words
+#   python -m benchmarks.bench_long_words --max-length 100000 --output long.json
+#
+# Words are measured both without separators (automatic clustering) and with
+# '=' separators between some of the syllables.
+
+import argparse
+import json
+import platform
+import sys
+import time
+from timeit import default_timer as timer
+
+from coreengine import converter as engine
+from benchmarks.corpus import generate_long_word
+
+LENGTHS = (10, 100, 1000, 10000, 100000, 1000000)
+VARIANTS = (("auto", 0.0), ("separated", 0.2))
+
+# Characters converted per measurement, so short words are repeated enough
+# times to be measured reliably
+BUDGET = 1000000
+
+
+def stages(word, forScrivener):
+    syllables = engine.tokenize_syllables(word)
+    clusters = engine.cluster_syllables(list(syllables))
+
+    return [
+        ("separate_syllables_regex", lambda: engine.separate_syllables_regex(word)),
+        ("cluster_syllables", lambda: engine.cluster_syllables(list(syllables))),
+        ("convert_cluster", lambda: [engine.cluster_glyphs(cluster, forScrivener)
+                                     for cluster in clusters]),
+        ("convert_word", lambda: engine.convert_word(word, forScrivener)),
+    ]
+
+
+def measure(run, iterations, repeat):
+    best = None
+    for _ in range(repeat):
+        start = timer()
+        for _ in range(iterations):
+            run()
+        elapsed = (timer() - start) / iterations
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run_benchmarks(lengths, seed, repeat, forScrivener):
+    results = {}
+
+    # Short words would otherwise be served from the word cache
+    engine.word_cache.enable(False)
+    try:
+        for variant, separator_ratio in VARIANTS:
+            results[variant] = {}
+            for length in lengths:
+                word = generate_long_word(length, seed, separator_ratio)
+                iterations = max(1, BUDGET // length)
+                results[variant][length] = {
+                    name: measure(run, iterations, repeat) / length
+                    for name, run in stages(word, forScrivener)
+                }
+    finally:
+        engine.word_cache.enable(True)
+
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "seed": seed,
+            "repeat": repeat,
+            "scrivener": forScrivener,
+        },
+        "seconds_per_char": results,
+    }
+
+
+# Prints the cost per character in nanoseconds, along with the ratio to the
+# cost at the shortest length which is long enough to hide the call overhead
+def report(results):
+    for variant, by_length in results["seconds_per_char"].items():
+        lengths = list(by_length)
+        reference = by_length[lengths[min(2, len(lengths) - 1)]]
+        names = list(by_length[lengths[0]])
+
+        print("{} (ns/char)".format(variant))
+        print("{:>10}".format("length") + "".join("{:>26}".format(name) for name in names))
+        for length in lengths:
+            print("{:>10}".format(length) + "".join(
+                "{:>17.1f} ({:>5.2f}x)".format(by_length[length][name] * 1e9,
+                                               by_length[length][name] / reference[name])
+                for name in names))
+        print()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the conversion of very long words.")
+    parser.add_argument("--max-length", type=int, default=LENGTHS[-1])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--scrivener", action="store_true")
+    parser.add_argument("--output", help="save the results as JSON")
+    args = parser.parse_args(argv)
+
+    lengths = [length for length in LENGTHS if length <= args.max_length]
+    results = run_benchmarks(lengths, args.seed, args.repeat, args.scrivener)
+    report(results)
+
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump(results, handle, indent=2)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,171 @@
+# Benchmark harness of the conversion pipeline. Every stage is timed on its
+# own over the same synthetic corpus, plus end-to-end conversion with a cold
+# and a warm word cache:
+#
+#   python -m benchmarks.bench_pipeline --output results.json
+#   python -m benchmarks.bench_pipeline --compare results.json
+#
+# Throughput is reported in words and characters per second, along with the
+# peak memory traced while the stage runs and the net number of memory blocks
+# it leaves allocated.
+
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from timeit import default_timer as timer
+
+from coreengine import converter as engine
+from coreengine import bulk
+from benchmarks.corpus import generate_sentences, convertible
+
+
+def build_inputs(sentences, forScrivener):
+    words = [word for sentence in sentences for word in engine.separate_words(sentence)]
+    syllables = [engine.tokenize_syllables(word) for word in words]
+    clusters = [cluster for word_syllables in syllables
+                for cluster in engine.cluster_syllables(list(word_syllables))]
+
+    return {
+        "sentences": sentences,
+        "words": words,
+        "syllables": syllables,
+        "clusters": clusters,
+        "forScrivener": forScrivener,
+    }
+
+
+# (name, items the stage consumes, function running the stage over them)
+def stages(inputs):
+    forScrivener = inputs["forScrivener"]
+
+    def converter_cold():
+        engine.word_cache.enable(False)
+        try:
+            for sentence in inputs["sentences"]:
+                engine.converter(sentence, forScrivener)
+        finally:
+            engine.word_cache.enable(True)
+
+    def converter_warm():
+        for sentence in inputs["sentences"]:
+            engine.converter(sentence, forScrivener)
+
+    timed = [
+        ("separate_words", lambda: [engine.separate_words(sentence)
+                                    for sentence in inputs["sentences"]]),
+        ("separate_syllables_regex", lambda: [engine.separate_syllables_regex(word)
+                                              for word in inputs["words"]]),
+        ("cluster_syllables", lambda: [engine.cluster_syllables(list(syllables))
+                                       for syllables in inputs["syllables"]]),
+        ("convert_cluster", lambda: [engine.convert_cluster(cluster, forScrivener)
+                                     for cluster in inputs["clusters"]]),
+        ("converter", converter_cold),
+        ("converter_cached", converter_warm),
+    ]
+
+    # The vectorized engine needs the optional NumPy package
+    if bulk.np is not None:
+        timed.append(("converter_bulk", lambda: bulk.converter_bulk(inputs["sentences"],
+                                                                   forScrivener)))
+
+    return timed
+
+
+def measure(run, repeat):
+    best = None
+    for _ in range(repeat):
+        start = timer()
+        run()
+        elapsed = timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    # Memory is measured on a separate run, tracing slows the stage down
+    blocks = sys.getallocatedblocks()
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    net_blocks = sys.getallocatedblocks() - blocks
+
+    return best, peak, net_blocks
+
+
+def run_benchmarks(count, seed, repeat, forScrivener):
+    sentences = [sentence for sentence in generate_sentences(count, seed)
+                 if convertible(sentence)]
+    inputs = build_inputs(sentences, forScrivener)
+    word_count = len(inputs["words"])
+    char_count = sum(len(word) for word in inputs["words"])
+
+    results = {}
+    for name, run in stages(inputs):
+        seconds, peak, net_blocks = measure(run, repeat)
+        results[name] = {
+            "seconds": seconds,
+            "words_per_s": word_count / seconds,
+            "chars_per_s": char_count / seconds,
+            "peak_bytes": peak,
+            "net_blocks": net_blocks,
+        }
+
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "sentences": len(sentences),
+            "words": word_count,
+            "chars": char_count,
+            "seed": seed,
+            "repeat": repeat,
+            "scrivener": forScrivener,
+        },
+        "stages": results,
+    }
+
+
+def report(results, baseline=None):
+    print("{:<26}{:>12}{:>14}{:>14}{:>12}{:>10}".format(
+        "stage", "seconds", "words/s", "chars/s", "peak KiB", "vs base"))
+
+    for name, stage in results["stages"].items():
+        ratio = ""
+        if baseline and name in baseline["stages"]:
+            ratio = "{:.2f}x".format(baseline["stages"][name]["seconds"] / stage["seconds"])
+        print("{:<26}{:>12.4f}{:>14,.0f}{:>14,.0f}{:>12,.1f}{:>10}".format(
+            name, stage["seconds"], stage["words_per_s"], stage["chars_per_s"],
+            stage["peak_bytes"] / 1024, ratio))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the stages of the conversion pipeline.")
+    parser.add_argument("--sentences", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--scrivener", action="store_true")
+    parser.add_argument("--output", help="save the results as JSON")
+    parser.add_argument("--compare", help="JSON results of a previous run")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.sentences, args.seed, args.repeat, args.scrivener)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as handle:
+            baseline = json.load(handle)
+
+    report(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump(results, handle, indent=2)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
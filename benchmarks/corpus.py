@@ -0,0 +1,108 @@
+# Reproducible synthetic corpus for the benchmarks and the golden-output
+# regression corpus. Words are assembled from the character groups of the
+# converter, so the corpus exercises the same alphabet as real input:
+# digraphs, '-' vowel removal, '=' manual separators and very long words.
+
+import random
+
+from coreengine.converter import (converter, characterGroups,
+                                  single_char_substitute, halfSizeSubstitution)
+from coreengine.errors import MissingGlyphError
+
+# Latin spelling of every consonant and vowel the font has glyphs for,
+# including the digraphs
+CONSONANTS = [ch for ch in characterGroups["consonants"]
+              if ch < '\ue000' and ch in halfSizeSubstitution['horizontal']] + \
+    [digraph for digraph, ch in single_char_substitute.items()
+     if ch in characterGroups["consonants"]]
+VOWELS = [characterGroups["a"]] + \
+    [ch for ch in characterGroups["non-a"] if ch < '\ue000'] + \
+    [digraph for digraph, ch in single_char_substitute.items()
+     if ch not in characterGroups["consonants"]]
+
+# Consonants which are not part of any digraph. Long words are built from
+# these only, because a single syllable without a glyph (e.g. 'nnngee', where
+# 'ng' swallows a letter of 'nn') would make the whole word unconvertible.
+UNAMBIGUOUS_CONSONANTS = [ch for ch in CONSONANTS if len(ch) == 1 and not any(
+    ch in digraph for digraph in single_char_substitute)]
+
+# Words from the typing instructions and the known issues of the converter
+HANDPICKED_WORDS = [
+    "viatrix", "vi=at-=rihh", "viat-rihh", "otlium", "ot-=lium-", "c-=la=ee",
+    "c-=lee", "la=e", "bahh", "tha", "nnyo", "sya", "ngeu", "hhhe", "annna",
+]
+
+
+def random_syllable(rng):
+    roll = rng.random()
+    if roll < 0.6:
+        consonant = rng.choice(CONSONANTS)
+        vowel = rng.choice(VOWELS)
+        # Only the first digraph of a syllable is substituted by the converter,
+        # so a digraph consonant is never followed by a digraph vowel
+        while len(consonant) + len(vowel) > 3:
+            vowel = rng.choice(VOWELS)
+        return consonant + vowel
+    if roll < 0.8:
+        return rng.choice(VOWELS)
+    return rng.choice(CONSONANTS) + characterGroups["vr"]
+
+
+def random_word(rng, syllables):
+    parts = []
+    for index in range(syllables):
+        if index and rng.random() < 0.1:
+            parts.append(characterGroups["separator"])
+        parts.append(random_syllable(rng))
+    return "".join(parts)
+
+
+# A single word of exactly the given number of characters. With a
+# separator_ratio, that share of the syllables is preceded by a '=' separator.
+def generate_long_word(length, seed=0, separator_ratio=0.0):
+    rng = random.Random(seed)
+    parts = []
+    size = 0
+
+    while size < length:
+        if parts and separator_ratio and rng.random() < separator_ratio:
+            parts.append(characterGroups["separator"])
+            size += 1
+        if rng.random() < 0.7:
+            syllable = rng.choice(UNAMBIGUOUS_CONSONANTS) + rng.choice(VOWELS)
+        else:
+            syllable = rng.choice(VOWELS)
+        parts.append(syllable)
+        size += len(syllable)
+
+    return "".join(parts)[:length]
+
+
+# Returns a list of sentences. Every sentence holds between 1 and
+# max_words words; a small share of the words are pathologically long.
+def generate_sentences(count, seed=0, max_words=12, long_word_length=5000,
+                       long_word_ratio=0.001):
+    rng = random.Random(seed)
+    sentences = []
+
+    for _ in range(count):
+        words = []
+        for _ in range(rng.randint(1, max_words)):
+            if rng.random() < long_word_ratio:
+                words.append(generate_long_word(long_word_length, rng.random()))
+            else:
+                words.append(random_word(rng, rng.randint(1, 5)))
+        sentences.append(" ".join(words))
+
+    return sentences
+
+
+# Whether the converter accepts the text. Some well-formed looking words still
+# hit combinations without a glyph (e.g. 'ng' followed by 'ee' in a cluster);
+# the benchmarks skip those, the golden corpus records the error instead.
+def convertible(text):
+    try:
+        converter(text)
+    except MissingGlyphError:
+        return False
+    return True
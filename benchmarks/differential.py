@@ -0,0 +1,228 @@
+# Differential checks of the parts of the engine the golden corpus does not
+# reach, on seeded random input. Every check compares an optimized path with
+# the plain converter (or with a reference implementation) and counts the
+# cases whose results differ:
+#
+#   python -m benchmarks.differential                  # every check
+#   python -m benchmarks.differential documents --cases 500 --seed 3
+#
+# * documents: random edit sequences on incremental documents (see
+#   coreengine.incremental), compared with converting the whole text again
+# * bulk: random batches through the NumPy engine (see coreengine.bulk),
+#   compared with converter_many(), in every render profile and with or
+#   without normalization; skipped without NumPy
+# * clustering: random syllable lists through cluster_syllables(), compared
+#   with the original (quadratic) implementation kept below
+
+import argparse
+import random
+import sys
+
+from coreengine import bulk
+from coreengine.converter import converter, converter_many, cluster_syllables, PROFILES
+from coreengine.errors import MissingGlyphError
+from coreengine.incremental import IncrementalDocument
+from benchmarks.corpus import random_syllable, generate_long_word
+
+# Characters mixed into the edits besides whole syllables: word boundaries,
+# separators, and characters normalization folds or strips
+EDIT_CHARACTERS = [" ", " ", "=", "-", "a", "n", "g", "h", "À", "B", "!"]
+
+# Pieces of the random texts of the bulk check: letters and digraphs, the
+# first glyphs of the font (i.e. input converted before), word boundaries, and
+# junk for some of the batches
+BULK_PIECES = list("abcdefghijklmnopqrstuvwxyz\u00e9-=  ") + \
+    [chr(0xe000 + index) for index in range(6)] + \
+    ["nn", "hh", "th", "ee", "eu", "ng", "ny", "sy"]
+BULK_JUNK = list("1,.!\tA\u00c9<>\n")
+
+
+def random_edit_text(rng):
+    parts = []
+    for _ in range(rng.choice((0, 1, 1, 2, 4))):
+        if rng.random() < 0.6:
+            parts.append(random_syllable(rng))
+        else:
+            parts.append(rng.choice(EDIT_CHARACTERS))
+    return "".join(parts)
+
+
+# The converted text, or the error the converter raises for it
+def reference(text, profile):
+    try:
+        return converter(text, profile=profile)[0]
+    except MissingGlyphError:
+        return MissingGlyphError
+
+
+# Returns (mismatches, cases). After every edit the document has to hold the
+# edited text, with the word offsets it implies, and convert to the same
+# glyphs as converter(); edits the converter rejects have to be rejected and
+# leave the document unchanged.
+def check_documents(cases, seed):
+    rng = random.Random(seed)
+    mismatches = []
+    count = 0
+
+    for case in range(cases):
+        profile = PROFILES[case % len(PROFILES)]
+        text = " ".join(random_edit_text(rng) for _ in range(rng.randint(0, 8)))
+        if reference(text, profile) is MissingGlyphError:
+            continue
+        document = IncrementalDocument(text, profile=profile)
+
+        for _ in range(rng.randint(1, 60)):
+            # Mostly typing at the same place, sometimes elsewhere
+            start = rng.randint(0, len(text))
+            end = min(len(text), start + rng.choice((0, 0, 1, 3, 12)))
+            replacement = random_edit_text(rng)
+            edited = text[:start] + replacement + text[end:]
+            expected = reference(edited, profile)
+            count += 1
+
+            try:
+                document.apply_edit(start, end, replacement)
+            except MissingGlyphError:
+                if expected is not MissingGlyphError or document.text != text:
+                    mismatches.append((text, start, end, replacement, profile))
+                continue
+
+            starts = []
+            offset = 0
+            for word in document.words:
+                starts.append(offset)
+                offset += len(word) + 1
+
+            if (expected is MissingGlyphError or document.text != edited
+                    or document.length != len(edited)
+                    or [document.word_start(index) for index in range(len(starts))] != starts
+                    or document.result()[0] != expected):
+                mismatches.append((text, start, end, replacement, profile))
+                break
+            text = edited
+
+    return mismatches, count
+
+
+# The results of converter_many() or converter_bulk(), or the error they
+# raise along with the index of the rejected sentence
+def batch_result(convert, sentences, profile, normalization):
+    try:
+        return convert(sentences, profile=profile, normalization=normalization)
+    except MissingGlyphError as error:
+        return str(error), error.index
+
+
+# Returns (mismatches, cases)
+def check_bulk(cases, seed):
+    if bulk.np is None:
+        print("NumPy is not installed, skipping the bulk engine")
+        return [], 0
+
+    rng = random.Random(seed)
+    mismatches = []
+    count = 0
+
+    for case in range(cases):
+        pieces = BULK_PIECES + (BULK_JUNK if case % 3 == 0 else [])
+        sentences = ["".join(rng.choice(pieces) for _ in range(rng.randint(0, 30)))
+                     for _ in range(rng.randint(1, 20))]
+        if case % 10 == 0:
+            sentences.append(generate_long_word(rng.randint(50, 300), case, 0.1 * (case % 2)))
+
+        for profile in PROFILES:
+            for normalization in ('strip', 'none'):
+                count += 1
+                if (batch_result(bulk.converter_bulk, sentences, profile, normalization)
+                        != batch_result(converter_many, sentences, profile, normalization)):
+                    mismatches.append((sentences, profile, normalization))
+
+    return mismatches, count
+
+
+# cluster_syllables() before it was made linear, as the reference of the
+# clustering check
+def reference_clusters(syllables):
+    clusters = []
+
+    if u'=' in syllables:
+        clusters = [syl.split(',') for syl in (','.join(syllables)).split('=')]
+    else:
+        while len(syllables) > 0:
+            if len(''.join(syllables[:3])) <= 4:
+                clusters.append(syllables[:3])
+                syllables = syllables[3:]
+            else:
+                clusters.append(syllables[:2])
+                syllables = syllables[2:]
+
+    for cluster in clusters:
+        while '' in cluster:
+            cluster.remove('')
+
+    return clusters
+
+
+# Syllables of the clustering check, including the separators, commas and
+# empty syllables the tokenizer can give for junk input without normalization
+def random_syllables(rng):
+    syllables = []
+    for _ in range(rng.randint(0, 12)):
+        roll = rng.random()
+        if roll < 0.6:
+            syllables.append(random_syllable(rng))
+        elif roll < 0.75:
+            syllables.append(u'=')
+        else:
+            syllables.append(rng.choice((u'', u',', u',o', u'k,', u'a=e', u'ng', u'e')))
+    return syllables
+
+
+# Returns (mismatches, cases)
+def check_clustering(cases, seed):
+    rng = random.Random(seed)
+    mismatches = []
+    count = cases * 500
+
+    for _ in range(count):
+        syllables = random_syllables(rng)
+        if cluster_syllables(list(syllables)) != reference_clusters(list(syllables)):
+            mismatches.append(syllables)
+
+    return mismatches, count
+
+
+CHECKS = {
+    "documents": check_documents,
+    "bulk": check_bulk,
+    "clustering": check_clustering,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare the optimized paths of the engine with the plain converter.")
+    parser.add_argument("checks", nargs="*",
+                        help="checks to run, among {} (default: all of them)".format(
+                            ", ".join(CHECKS)))
+    parser.add_argument("--cases", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    unknown = [name for name in args.checks if name not in CHECKS]
+    if unknown:
+        parser.error("unknown check(s): {}".format(", ".join(unknown)))
+
+    failed = False
+    for name in args.checks or CHECKS:
+        mismatches, count = CHECKS[name](args.cases, args.seed)
+        for mismatch in mismatches[:10]:
+            print("Mismatch in {}: {!r}".format(name, mismatch))
+        print("{}: {} mismatches of {}".format(name, len(mismatches), count))
+        failed = failed or bool(mismatches)
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
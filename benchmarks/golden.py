@@ -0,0 +1,118 @@
+# Golden-output regression corpus. golden/corpus.json holds the converter's
+# output (in both normal and Scrivener mode) for a fixed set of inputs, so an
+# optimization can be checked to be output-identical:
+#
+#   python -m benchmarks.golden              # verify the current engine
+#   python -m benchmarks.golden --regenerate # record a deliberate change
+#
+# Inputs the converter rejects are recorded with the name of the exception.
+# When NumPy is installed, the bulk engine (coreengine.bulk) is verified
+# against the same entries.
+
+import argparse
+import json
+import os
+import sys
+
+from coreengine import bulk
+from coreengine.converter import converter
+from benchmarks.corpus import HANDPICKED_WORDS, generate_sentences, generate_long_word
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "golden", "corpus.json")
+
+
+def golden_inputs():
+    inputs = list(HANDPICKED_WORDS)
+    inputs.append(" ".join(HANDPICKED_WORDS))
+    inputs.extend(generate_sentences(600, seed=1, max_words=6, long_word_ratio=0.0))
+    inputs.extend(generate_long_word(length, seed=length) for length in (64, 256, 1024))
+    return inputs
+
+
+def convert_entry(text):
+    entry = {"input": text}
+
+    for key, forScrivener in (("default", False), ("scrivener", True)):
+        try:
+            glyphs, code_points = converter(text, forScrivener)
+        except Exception as error:
+            entry[key] = {"error": type(error).__name__}
+        else:
+            entry[key] = {"text": glyphs, "codepoints": code_points}
+
+    return entry
+
+
+def regenerate(path=CORPUS_PATH):
+    entries = [convert_entry(text) for text in golden_inputs()]
+    with open(path, "w", encoding="utf-8") as handle:
+        json.dump(entries, handle, ensure_ascii=True, indent=1)
+    return len(entries)
+
+
+# Returns the entries whose current output differs from the recorded one
+def verify(path=CORPUS_PATH):
+    with open(path, encoding="utf-8") as handle:
+        entries = json.load(handle)
+
+    return [(entry, current) for entry, current in
+            ((entry, convert_entry(entry["input"])) for entry in entries)
+            if entry != current]
+
+
+# Same as verify() for converter_bulk(), converting the accepted inputs of the
+# corpus as one batch. Returns an empty list without NumPy.
+def verify_bulk(path=CORPUS_PATH):
+    if bulk.np is None:
+        return []
+    with open(path, encoding="utf-8") as handle:
+        entries = json.load(handle)
+
+    mismatches = []
+    for key, forScrivener in (("default", False), ("scrivener", True)):
+        accepted = [entry for entry in entries if "error" not in entry[key]]
+        results = bulk.converter_bulk([entry["input"] for entry in accepted], forScrivener)
+        for entry, (glyphs, code_points) in zip(accepted, results):
+            current = {"text": glyphs, "codepoints": code_points}
+            if entry[key] != current:
+                mismatches.append((entry, {"bulk": True, key: current}))
+
+        for entry in entries:
+            if "error" in entry[key]:
+                try:
+                    bulk.converter_bulk([entry["input"]], forScrivener)
+                except Exception as error:
+                    current = {"error": type(error).__name__}
+                else:
+                    current = {"error": None}
+                if entry[key] != current:
+                    mismatches.append((entry, {"bulk": True, key: current}))
+
+    return mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Verify the converter against the golden-output corpus.")
+    parser.add_argument("--regenerate", action="store_true",
+                        help="overwrite the corpus with the current output")
+    args = parser.parse_args(argv)
+
+    if args.regenerate:
+        print("Recorded {} entries in {}".format(regenerate(), CORPUS_PATH))
+        return 0
+
+    mismatches = verify() + verify_bulk()
+    if bulk.np is None:
+        print("NumPy is not installed, skipping the bulk engine")
+    for expected, current in mismatches[:20]:
+        print("Mismatch for {!r}:\n  expected {!r}\n  got      {!r}".format(
+            expected["input"], expected, current))
+    print("{} mismatches".format(len(mismatches)))
+
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,333 @@
+# End-to-end load test of the Flask application. Requests are sent by a number
+# of concurrent clients, either through the Flask test client (in process) or
+# over HTTP to a local WSGI server started for the run:
+#
+#   python -m benchmarks.loadtest
+#   python -m benchmarks.loadtest --concurrency 1 8 32 --sizes 64 4096 --server
+#   python -m benchmarks.loadtest --endpoints form --scrivener-ratio 1 --output load.json
+#
+# Every request picks an endpoint (the /transliterator/ form, the cacheable
+# GET /api/convert or the batch POST /api/convert), a payload size and the
+# Scrivener option at random. For every concurrency level the throughput and
+# the p50/p95/p99 latencies are reported, along with the share of the request
+# time spent in the converter and in render_template(), so regressions of the
+# web layer show up as well as those of the engine.
+
+import argparse
+import http.client
+import itertools
+import json
+import platform
+import random
+import sys
+import threading
+import time
+import urllib.parse
+from socketserver import ThreadingMixIn
+from timeit import default_timer as timer
+from wsgiref.simple_server import make_server, WSGIServer, WSGIRequestHandler
+
+import transliterator
+from benchmarks.corpus import generate_sentences, convertible
+
+ENDPOINTS = ("form", "api", "batch")
+SIZES = (64, 1024, 16384)
+CONCURRENCY = (1, 4, 16)
+# Distinct texts generated for each payload size
+TEXTS_PER_SIZE = 32
+PERCENTILES = (50, 95, 99)
+
+
+# Time spent in the wrapped functions of the application, summed over all
+# the requests (and threads)
+class SplitTimer:
+    def __init__(self):
+        self.seconds = {}
+        self._lock = threading.Lock()
+
+    def wrap(self, name, function):
+        def timed(*args, **kwargs):
+            start = timer()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = timer() - start
+                with self._lock:
+                    self.seconds[name] = self.seconds.get(name, 0.0) + elapsed
+        return timed
+
+    def reset(self):
+        with self._lock:
+            self.seconds = {}
+
+
+# Time the conversions and the template rendering of the views. The views
+# look the functions up in the module, so wrapping the module globals is
+# enough.
+def instrument_app(split):
+    transliterator.converter = split.wrap("converter", transliterator.converter)
+    transliterator.converter_many = split.wrap("converter", transliterator.converter_many)
+    transliterator.render_template = split.wrap("render_template",
+                                                transliterator.render_template)
+
+
+# Lists of convertible sentences of about each payload size (in characters)
+def build_payloads(sizes, seed):
+    sentences = [sentence for sentence in generate_sentences(5000, seed, long_word_ratio=0)
+                 if convertible(sentence)]
+    rng = random.Random(seed)
+    payloads = {}
+
+    for size in sizes:
+        payloads[size] = []
+        for _ in range(TEXTS_PER_SIZE):
+            parts = []
+            length = -1
+            while length < size:
+                sentence = rng.choice(sentences)
+                parts.append(sentence)
+                length += len(sentence) + 1
+            payloads[size].append(parts)
+
+    return payloads
+
+
+# The requests of a run: (endpoint, list of sentences, Scrivener option)
+def build_plan(count, endpoints, payloads, scrivener_ratio, seed):
+    rng = random.Random(seed)
+    sizes = sorted(payloads)
+    return [(rng.choice(endpoints), rng.choice(payloads[rng.choice(sizes)]),
+             rng.random() < scrivener_ratio) for _ in range(count)]
+
+
+def request_args(endpoint, sentences, scrivener):
+    text = u" ".join(sentences)
+    if endpoint == "form":
+        data = {"text_input": text}
+        if scrivener:
+            data["scrivener_checkbox"] = "on"
+        return ("POST", "/transliterator/", urllib.parse.urlencode(data),
+                "application/x-www-form-urlencoded")
+    if endpoint == "api":
+        query = {"text": text}
+        if scrivener:
+            query["scrivener"] = "1"
+        return "GET", "/api/convert?" + urllib.parse.urlencode(query), None, None
+    return ("POST", "/api/convert", json.dumps({"texts": sentences, "scrivener": scrivener}),
+            "application/json")
+
+
+# Sends the requests through the Flask test client, in the calling thread
+class TestClientTransport:
+    def __init__(self):
+        self.client = transliterator.app.test_client()
+
+    def send(self, method, path, body, content_type):
+        response = self.client.open(path, method=method, data=body, content_type=content_type)
+        response.get_data()
+        return response.status_code
+
+
+# Sends the requests over HTTP
+class HTTPTransport:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+
+    def send(self, method, path, body, content_type):
+        connection = http.client.HTTPConnection(self.host, self.port)
+        try:
+            headers = {"Content-Type": content_type} if content_type else {}
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            return response.status
+        finally:
+            connection.close()
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+# Serve the application on a free local port, in a background thread
+def start_server():
+    server = make_server("127.0.0.1", 0, transliterator.app, server_class=ThreadingWSGIServer,
+                         handler_class=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# Nearest-rank percentile of sorted values
+def percentile(values, rank):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, -(-len(values) * rank // 100) - 1))]
+
+
+def summarize(latencies):
+    latencies = sorted(latencies)
+    return {"requests": len(latencies),
+            **{"p{}".format(rank): percentile(latencies, rank) for rank in PERCENTILES}}
+
+
+# Send the planned requests from concurrency threads at once
+def run_level(make_transport, plan, concurrency, split):
+    requests = [request_args(*entry) for entry in plan]
+    counter = itertools.count()
+    records = []
+    lock = threading.Lock()
+
+    def client():
+        transport = make_transport()
+        done = []
+        while True:
+            index = next(counter)
+            if index >= len(requests):
+                break
+            start = timer()
+            status = transport.send(*requests[index])
+            done.append((plan[index][0], timer() - start, status))
+        with lock:
+            records.extend(done)
+
+    split.reset()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = timer()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = timer() - start
+
+    busy = sum(latency for _, latency, _ in records)
+    result = summarize([latency for _, latency, _ in records])
+    result.update({
+        "concurrency": concurrency,
+        "errors": sum(1 for _, _, status in records if status >= 400),
+        "seconds": wall,
+        "rps": len(records) / wall,
+        "split": {name: seconds / busy for name, seconds in split.seconds.items()},
+        "endpoints": {endpoint: summarize([latency for name, latency, _ in records
+                                           if name == endpoint])
+                      for endpoint in sorted({name for name, _, _ in records})},
+    })
+    return result
+
+
+def run_loadtest(concurrency_levels, requests, endpoints, sizes, scrivener_ratio, seed,
+                 server=False, cold=False, warmup=50):
+    split = SplitTimer()
+    instrument_app(split)
+    if cold:
+        transliterator.word_cache.enable(False)
+
+    payloads = build_payloads(sizes, seed)
+    plan = build_plan(requests, endpoints, payloads, scrivener_ratio, seed)
+
+    httpd = None
+    if server:
+        httpd = start_server()
+        host, port = httpd.server_address[:2]
+        make_transport = lambda: HTTPTransport(host, port)
+    else:
+        make_transport = TestClientTransport
+
+    try:
+        # Compile the template and fill the caches before measuring
+        run_level(make_transport, plan[:warmup], 1, split)
+        levels = [run_level(make_transport, plan, concurrency, split)
+                  for concurrency in concurrency_levels]
+    finally:
+        if httpd is not None:
+            httpd.shutdown()
+            httpd.server_close()
+
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "transport": "wsgiref" if server else "test_client",
+            "requests": requests,
+            "endpoints": list(endpoints),
+            "sizes": list(sizes),
+            "scrivener_ratio": scrivener_ratio,
+            "seed": seed,
+            "word_cache": not cold,
+        },
+        "levels": levels,
+    }
+
+
+def report(results, baseline=None):
+    baseline_levels = {}
+    if baseline:
+        baseline_levels = {level["concurrency"]: level for level in baseline["levels"]}
+
+    print("{:>6}{:>10}{:>8}{:>10}{:>10}{:>10}{:>10}{:>11}{:>9}{:>8}{:>10}".format(
+        "conc", "requests", "errors", "req/s", "p50 ms", "p95 ms", "p99 ms",
+        "converter", "render", "other", "vs base"))
+
+    for level in results["levels"]:
+        split = level["split"]
+        converter_share = split.get("converter", 0.0)
+        render_share = split.get("render_template", 0.0)
+        ratio = ""
+        base = baseline_levels.get(level["concurrency"])
+        if base:
+            ratio = "{:.2f}x".format(level["rps"] / base["rps"])
+        print("{:>6}{:>10}{:>8}{:>10,.1f}{:>10.2f}{:>10.2f}{:>10.2f}{:>10.1%}{:>9.1%}{:>8.1%}{:>10}"
+              .format(level["concurrency"], level["requests"], level["errors"], level["rps"],
+                      level["p50"] * 1e3, level["p95"] * 1e3, level["p99"] * 1e3,
+                      converter_share, render_share,
+                      max(0.0, 1 - converter_share - render_share), ratio))
+        for endpoint, stats in level["endpoints"].items():
+            print("{:>16}{:>8}{:>28.2f}{:>10.2f}{:>10.2f}".format(
+                endpoint, stats["requests"], stats["p50"] * 1e3, stats["p95"] * 1e3,
+                stats["p99"] * 1e3))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Load test the Flask application end to end.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=list(CONCURRENCY))
+    parser.add_argument("--requests", type=int, default=1000,
+                        help="requests per concurrency level (default: %(default)s)")
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=list(ENDPOINTS))
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES),
+                        help="payload sizes in characters (default: %(default)s)")
+    parser.add_argument("--scrivener-ratio", type=float, default=0.5,
+                        help="share of the requests in Scrivener mode (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--server", action="store_true",
+                        help="send the requests over HTTP to a local WSGI server "
+                             "instead of the Flask test client")
+    parser.add_argument("--cold", action="store_true", help="disable the word cache")
+    parser.add_argument("--output", help="save the results as JSON")
+    parser.add_argument("--compare", help="JSON results of a previous run")
+    args = parser.parse_args(argv)
+
+    results = run_loadtest(args.concurrency, args.requests, args.endpoints, args.sizes,
+                           args.scrivener_ratio, args.seed, args.server, args.cold)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as handle:
+            baseline = json.load(handle)
+    report(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump(results, handle, indent=2)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,74 @@
+# Command line interface of the converter, e.g.
+#
+#   python -m coreengine lore.txt > lore.pa.txt
+#   cat dialogue.txt | python -m coreengine --scrivener
+#   python -m coreengine --profile renpy script.txt
+#
+# Files (or the standard input) are streamed through iter_convert(), so large
+# documents are converted without loading them in memory as a whole.
+
+import argparse
+import io
+import sys
+
+from coreengine.converter import iter_convert, PROFILES
+from coreengine.errors import ConversionError
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m coreengine",
+        description="Convert plain text input into Proto-Altekhsnan glyphs.")
+    parser.add_argument("files", nargs="*", metavar="FILE",
+                        help="input files (default: standard input)")
+    parser.add_argument("--scrivener", action="store_true",
+                        help="swap the code points of 'h', 'n', and 'th' for Scrivener use")
+    parser.add_argument("--profile", choices=PROFILES,
+                        help="adapt the glyphs to the target application "
+                             "(overrides --scrivener)")
+    parser.add_argument("--codepoints", nargs="?", const="python", metavar="FORMAT",
+                        choices=("python", "unicode", "html"),
+                        help="write the code points (in the given format, default: python) "
+                             "instead of the glyphs")
+    parser.add_argument("--strict", action="store_true",
+                        help="reject input with unsupported characters instead of stripping them")
+    parser.add_argument("--chunk-size", type=int, default=65536,
+                        help="number of characters read at a time (default: %(default)s)")
+    parser.add_argument("--encoding", default="utf-8",
+                        help="encoding of the input and output (default: %(default)s)")
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    output = io.TextIOWrapper(sys.stdout.buffer, encoding=args.encoding, newline="")
+    output_format = args.codepoints or 'none'
+    normalization = 'strict' if args.strict else 'strip'
+    selected = 1 if args.codepoints else 0
+
+    def convert(stream):
+        for converted in iter_convert(stream, args.scrivener, args.chunk_size, output_format,
+                                      normalization, args.profile):
+            output.write(converted[selected])
+
+    try:
+        if not args.files:
+            convert(io.TextIOWrapper(sys.stdin.buffer, encoding=args.encoding))
+
+        for path in args.files:
+            with open(path, encoding=args.encoding) as stream:
+                convert(stream)
+    except ConversionError as error:
+        output.flush()
+        sys.stderr.write("error: {}\n".format(error))
+        return 1
+    finally:
+        output.flush()
+        output.detach()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,102 @@
+# Work budgets of the conversions. A budget bounds the length of the input,
+# the length of every word and the wall-clock time of a conversion; the limits
+# are checked cooperatively between words, so a single word is never
+# interrupted (which max_word_length bounds instead).
+#
+# On overrun a budget either raises one of the BudgetExceeded errors
+# ('raise' mode), or lets the conversion return the output of the words
+# converted so far followed by TRUNCATION_MARKER ('truncate' mode).
+
+from time import perf_counter
+
+from coreengine.errors import InputTooLarge, WordTooLong, DeadlineExceeded
+
+BUDGET_MODES = ('raise', 'truncate')
+TRUNCATION_MARKER = u"\u2026"
+
+
+class ConversionBudget:
+    __slots__ = ("max_chars", "max_word_length", "max_seconds", "mode")
+
+    def __init__(self, max_chars=None, max_word_length=None, max_seconds=None, mode='raise'):
+        if mode not in BUDGET_MODES:
+            raise ValueError("Unknown budget mode {!r}, expected one of: {}.".format(
+                mode, ", ".join(BUDGET_MODES)))
+        self.max_chars = max_chars
+        self.max_word_length = max_word_length
+        self.max_seconds = max_seconds
+        self.mode = mode
+
+    @property
+    def unlimited(self):
+        return self.max_chars is None and self.max_word_length is None and self.max_seconds is None
+
+    # Point in time (in perf_counter() seconds) the conversion has to finish by
+    def deadline(self):
+        if self.max_seconds is None:
+            return None
+        return perf_counter() + self.max_seconds
+
+    # Whether an input of the given length is within the budget. Raises
+    # InputTooLarge in raise mode.
+    def check_size(self, length, limit=None):
+        limit = self.max_chars if limit is None else limit
+        if limit is None or length <= limit:
+            return True
+        if self.mode == 'raise':
+            raise InputTooLarge(length, limit)
+        return False
+
+    # Returns (text, truncated). In truncate mode the text is cut after its
+    # last whole word within the limit (max_chars by default), or at the limit
+    # if even the first word is longer.
+    def limit_input(self, text, limit=None):
+        limit = self.max_chars if limit is None else limit
+        if self.check_size(len(text), limit):
+            return text, False
+        cut = max(text.rfind(u" ", 0, limit + 1), text.rfind(u"\n", 0, limit + 1))
+        return text[:cut if cut > 0 else limit], True
+
+    # Same as limit_input() for a batch of texts, with max_chars bounding their
+    # total length. Returns (texts, cut), where cut is the index of the first
+    # text which was cut short (the following ones are left empty), or None.
+    def limit_batch(self, texts):
+        if self.check_size(sum(len(text) for text in texts)):
+            return texts, None
+
+        remaining = self.max_chars
+        for index, text in enumerate(texts):
+            if len(text) > remaining:
+                limited = self.limit_input(text, remaining)[0]
+                return texts[:index] + [limited] + [u""] * (len(texts) - index - 1), index
+            remaining -= len(text)
+
+    # Whether the word at the given position may still be converted. Raises
+    # WordTooLong or DeadlineExceeded in raise mode.
+    def allows(self, word, position, deadline):
+        if self.max_word_length is not None and len(word) > self.max_word_length:
+            if self.mode == 'raise':
+                raise WordTooLong(position, len(word), self.max_word_length)
+            return False
+        if deadline is not None and perf_counter() > deadline:
+            if self.mode == 'raise':
+                raise DeadlineExceeded(self.max_seconds)
+            return False
+        return True
+
+
+# Join the converted words of a sentence like assemble_words(), as long as the
+# budget allows it. With truncated (or once the budget runs out in truncate
+# mode) the output ends with TRUNCATION_MARKER. Returns (glyphs, truncated).
+def assemble_within_budget(words, convert, budget, deadline, truncated=False):
+    converted = []
+
+    for position, word in enumerate(words):
+        if not budget.allows(word, position, deadline):
+            truncated = True
+            break
+        converted.append(convert(word))
+
+    if truncated:
+        converted.append(TRUNCATION_MARKER)
+    return u" ".join(converted), truncated
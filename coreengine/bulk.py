@@ -0,0 +1,418 @@
+# Vectorized bulk conversion of whole corpora, for offline jobs. Requires the
+# optional NumPy package; without it converter_bulk() is converter_many().
+#
+# Instead of walking every word in Python, the corpus is handled as a single
+# array of code points:
+#
+#   1. characters are classified with a lookup array, and every position gets
+#      a key packing the character before it and the next few characters;
+#   2. each distinct key is resolved once by the state machine of the
+#      tokenizer, giving the length and the final form of the syllable
+#      starting there (so the rules are never duplicated here);
+#   3. the syllables of all words are followed in lockstep, then merged and
+#      clustered with array operations;
+#   4. the output is gathered from a pool of precomputed glyph strings.
+#
+# Words the arrays cannot describe (characters outside of the alphabet,
+# syllables longer than the windows) are converted by the regular engine, so
+# the output is always the same as converter_many().
+
+import sys
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from coreengine.converter import (converter_many, normalize_many, canonical_word,
+                                  match_syllable, syllable_form, syllable_forms,
+                                  syllable_glyph, syllableGlyphs, special_vowels,
+                                  consonant_set, supportedCharacters,
+                                  resolve_profile, apply_profile)
+from coreengine.encoders import encode
+from coreengine.errors import MissingGlyphError
+
+# Number of characters converted at a time, which bounds the memory used by
+# the arrays (about a hundred bytes per character)
+BULK_CHUNK_SIZE = 1 << 20
+
+# Index of every character of the alphabet; 0 stands for "no character", i.e.
+# before the start or past the end of a word
+alphabet = ('',) + tuple(sorted(supportedCharacters))
+ALPHABET_BITS = 6
+ALPHABET_MASK = (1 << ALPHABET_BITS) - 1
+
+# Number of characters after the position packed in the keys. Positions whose
+# syllable cannot be matched inside the short window are looked up again with
+# the long one; if that still is not enough, the word goes to the regular
+# engine.
+WINDOWS = (2, 4, 8)
+
+# Resolved keys of each window: key -> (syllable length, form id, ambiguous)
+window_entries = {window: {} for window in WINDOWS}
+WINDOW_ENTRIES_LIMIT = 262144
+
+# Final syllable forms seen so far, and their ids
+forms = []
+form_ids = {}
+
+# Canonical glyphs of a syllable form in a cluster of a given size:
+# (form id, size) -> glyphs
+glyph_pieces = {}
+
+SEPARATOR_PIECE = 0
+SPACE_PIECE = 1
+CLUSTER_END = u"=="
+
+if np is not None:
+    alphabetTable = np.zeros(max(map(ord, supportedCharacters)) + 1, dtype=np.uint64)
+    for index, ch in enumerate(alphabet):
+        if index:
+            alphabetTable[ord(ch)] = index
+
+
+def form_id(form):
+    try:
+        return form_ids[form]
+    except KeyError:
+        form_ids[form] = len(forms)
+        forms.append(form)
+        return form_ids[form]
+
+
+class WindowExceeded(Exception):
+    pass
+
+
+# Characters of a window, as seen by the state machine. Reading past the
+# window means the match depends on characters the key does not hold.
+class WindowProbe:
+    __slots__ = ("chars",)
+
+    def __init__(self, chars):
+        self.chars = chars
+
+    def __getitem__(self, index):
+        if index >= len(self.chars):
+            raise WindowExceeded()
+        return self.chars[index]
+
+
+# The syllable starting at the position a key was packed for. The match is
+# only trusted if the state machine never looked past the window (or the word
+# ends inside the window).
+def resolve_window(key, window):
+    chars = []
+    for index in range(1, window + 1):
+        code = (key >> (ALPHABET_BITS * index)) & ALPHABET_MASK
+        if not code:
+            break
+        chars.append(alphabet[code])
+
+    previous = alphabet[key & ALPHABET_MASK]
+    word = previous + u"".join(chars)
+    index = len(previous)
+    length = len(word)
+    if index >= length:
+        return (1, -1, False)
+
+    # The word may go on after a full window
+    if len(chars) == window:
+        length = sys.maxsize
+    try:
+        end = match_syllable(WindowProbe(word), index, length)
+    except WindowExceeded:
+        return (1, -1, True)
+    if end == -1:
+        return (1, -1, False)
+
+    raw = word[index:end]
+    syllable = syllable_forms.get(raw)
+    if syllable is None:
+        syllable = syllable_form(raw)
+    return (end - index, form_id(syllable), False)
+
+
+# Keys of the given positions: the character before each position, followed
+# by up to window characters of the same word
+def window_keys(alphabet_codes, positions, window):
+    keys = alphabet_codes[positions]
+    alive = np.ones(positions.size, dtype=bool)
+    for index in range(1, window + 1):
+        codes = alphabet_codes[positions + index]
+        alive &= codes != 0
+        keys |= np.where(alive, codes, 0) << np.uint64(ALPHABET_BITS * index)
+    return keys
+
+
+# Resolve the keys of the positions into the step, form and ambiguity arrays
+def resolve_positions(alphabet_codes, positions, window, step, form, ambiguous):
+    unique_keys, inverse = np.unique(window_keys(alphabet_codes, positions, window),
+                                     return_inverse=True)
+    entries = window_entries[window]
+
+    resolved = []
+    for key in unique_keys.tolist():
+        entry = entries.get(key)
+        if entry is None:
+            entry = resolve_window(key, window)
+            if len(entries) < WINDOW_ENTRIES_LIMIT:
+                entries[key] = entry
+        resolved.append(entry)
+
+    resolved = np.array(resolved, dtype=np.int64).reshape(-1, 3)
+    step[positions] = resolved[inverse, 0]
+    form[positions] = resolved[inverse, 1]
+    ambiguous[positions] = resolved[inverse, 2] != 0
+
+
+# Number of flagged positions in each word
+def count_in_words(mask, word_starts, word_ends):
+    counts = np.concatenate(([0], np.cumsum(mask)))
+    return counts[word_ends] - counts[word_starts]
+
+
+# Positions reached from the starts by moving to successor[position] until
+# the sink (the last index), in order. The paths are followed by pointer
+# doubling: after k passes every position up to 2**k steps away is reached,
+# so long words take a logarithmic number of passes.
+def follow(starts, successor):
+    sink = successor.size - 1
+    reached = starts[starts != sink]
+    jump = successor
+
+    while reached.size and (jump[starts] != sink).any():
+        further = jump[reached]
+        reached = np.concatenate((reached, further[further != sink]))
+        jump = jump[jump]
+
+    return np.sort(reached)
+
+
+def form_properties():
+    lengths = np.array([len(tmp) for tmp in forms], dtype=np.int64)
+    separators = np.array([tmp == u'=' for tmp in forms], dtype=bool)
+    specials = np.array([tmp in special_vowels for tmp in forms], dtype=bool)
+    consonants = np.array([len(tmp) == 1 and tmp in consonant_set for tmp in forms],
+                          dtype=bool)
+    return lengths, separators, specials, consonants
+
+
+def glyph_piece(form, size):
+    key = (form, size)
+    glyphs = glyph_pieces.get(key)
+    if glyphs is None:
+        syllable = forms[form]
+        glyphs = syllableGlyphs.get(size, {}).get(syllable)
+        if glyphs is None:
+            glyphs = syllable_glyph(syllable, size)
+        glyph_pieces[key] = glyphs
+    return glyphs
+
+
+# Convert normalized texts, returning their glyphs adapted to the render
+# profile. Raises MissingGlyphError for syllables without glyphs, like the
+# regular engine.
+def convert_texts(texts, profile='opentype'):
+    text = u" ".join(texts)
+    codes = np.frombuffer(text.encode('utf-32-le', 'surrogatepass'), dtype=np.uint32)
+    length = codes.size
+
+    lengths = np.array([len(tmp) for tmp in texts], dtype=np.int64)
+    text_starts = np.concatenate(([0], np.cumsum(lengths + 1)[:-1]))
+
+    # Words, and the spaces which separate the words of a text
+    spaces = np.flatnonzero(codes == 32)
+    word_starts = np.concatenate(([0], spaces + 1))
+    word_ends = np.concatenate((spaces, [length]))
+    joins = np.zeros(length + 1, dtype=bool)
+    joins[text_starts[1:] - 1] = True
+    spaces = spaces[~joins[spaces]]
+
+    # Alphabet index of every character, shifted by one: alphabet_codes[p + 1]
+    # is the character at p, and the padding stands for the end of the text
+    alphabet_codes = np.zeros(length + WINDOWS[-1] + 1, dtype=np.uint64)
+    known = codes < alphabetTable.size
+    alphabet_codes[1:length + 1][known] = alphabetTable[codes[known]]
+
+    unknown = (alphabet_codes[1:length + 1] == 0) & (codes != 32)
+    word_lengths = word_ends - word_starts
+    candidates = (word_lengths > 0) & \
+        (count_in_words(unknown, word_starts, word_ends) == 0)
+
+    # Syllable found at every position of the candidate words
+    in_candidates = np.repeat(np.where(candidates, 1, 0), word_lengths + 1)[:length] > 0
+    positions = np.flatnonzero(in_candidates)
+
+    step = np.ones(length, dtype=np.int64)
+    form = np.full(length, -1, dtype=np.int64)
+    ambiguous = np.zeros(length, dtype=bool)
+    resolve_positions(alphabet_codes, positions, WINDOWS[0], step, form, ambiguous)
+    for window in WINDOWS[1:]:
+        positions = np.flatnonzero(ambiguous)
+        if not positions.size:
+            break
+        resolve_positions(alphabet_codes, positions, window, step, form, ambiguous)
+
+    vectorized = candidates & (count_in_words(ambiguous, word_starts, word_ends) == 0)
+    scalar_words = np.flatnonzero(~vectorized & (word_lengths > 0))
+
+    # Follow the syllables of every word at once
+    position_ends = np.repeat(word_ends, word_lengths + 1)[:length]
+    successor = np.arange(length + 1, dtype=np.int64)
+    successor[:length] += step
+    successor[:length][successor[:length] >= position_ends] = length
+    successor[length] = length
+    visited = follow(word_starts[vectorized], successor)
+
+    syllable_positions = visited[form[visited] >= 0]
+    syllable_ids = form[syllable_positions]
+    syllable_words = np.searchsorted(word_starts, syllable_positions, side='right') - 1
+
+    # Join the vowels h, n and th with the single consonant before them
+    form_lengths, separators, specials, consonants = form_properties()
+    merged = np.zeros(syllable_positions.size, dtype=bool)
+    merged[1:] = (specials[syllable_ids[1:]] & consonants[syllable_ids[:-1]]
+                  & (syllable_words[1:] == syllable_words[:-1]))
+    targets = np.flatnonzero(merged) - 1
+    if targets.size:
+        count = len(forms)
+        pairs, inverse = np.unique(syllable_ids[targets] * count
+                                   + syllable_ids[targets + 1], return_inverse=True)
+        joined = np.array([form_id(forms[pair // count] + forms[pair % count])
+                           for pair in pairs.tolist()], dtype=np.int64)
+        syllable_ids[targets] = joined[inverse]
+
+        kept = ~merged
+        syllable_positions = syllable_positions[kept]
+        syllable_ids = syllable_ids[kept]
+        syllable_words = syllable_words[kept]
+        form_lengths, separators, specials, consonants = form_properties()
+
+    # Clusters. The syllables of a word are runs in the syllable arrays.
+    count = syllable_positions.size
+    run_starts = np.flatnonzero(np.concatenate(
+        ([True], syllable_words[1:] != syllable_words[:-1])))[:count]
+    run_ends = np.concatenate((run_starts[1:], [count]))[:run_starts.size]
+    separator = separators[syllable_ids]
+    separated_runs = count_in_words(separator, run_starts, run_ends) > 0
+    separated = np.repeat(separated_runs, run_ends - run_starts)
+
+    sizes = np.zeros(count, dtype=np.int64)
+    last = np.zeros(count, dtype=bool)
+
+    # Automatic clustering: three syllables of four or less characters, or two
+    character_counts = np.concatenate(([0], np.cumsum(form_lengths[syllable_ids])))
+    syllable_ends = np.repeat(run_ends, run_ends - run_starts)
+    cursor = np.arange(count, dtype=np.int64)
+    three = np.minimum(cursor + 3, syllable_ends)
+    taken = np.where(character_counts[three] - character_counts[cursor] <= 4,
+                     three - cursor, np.minimum(cursor + 2, syllable_ends) - cursor)
+    successor = np.append(cursor + taken, count)
+    successor[:count][successor[:count] >= syllable_ends] = count
+
+    cursor = follow(run_starts[~separated_runs], successor)
+    taken = taken[cursor]
+    for index in range(3):
+        selected = taken > index
+        sizes[cursor[selected] + index] = taken[selected]
+    last[cursor + taken - 1] = True
+
+    # Clustering on the '=' separators
+    members = separated & ~separator
+    if members.any():
+        clusters = np.cumsum(separator) + syllable_words
+        cluster_sizes = np.bincount(clusters[members])
+        sizes[members] = cluster_sizes[clusters[members]]
+
+    # Every piece of the output is placed by its position in the input (times
+    # four, plus its order among the pieces at the same position)
+    pool = [CLUSTER_END, u" "]
+    keys = []
+    pieces = []
+
+    glyphs = ~separator
+    if glyphs.any():
+        largest = int(sizes.max()) + 1
+        pairs, inverse = np.unique(syllable_ids[glyphs] * largest + sizes[glyphs],
+                                   return_inverse=True)
+        keys.append(syllable_positions[glyphs] * 4)
+        pieces.append(inverse + len(pool))
+        pool.extend([glyph_piece(pair // largest, pair % largest)
+                     for pair in pairs.tolist()])
+
+    cluster_ends = last & ~separated
+    keys.append(syllable_positions[cluster_ends] * 4 + 1)
+    pieces.append(np.full(int(cluster_ends.sum()), SEPARATOR_PIECE, dtype=np.int64))
+
+    keys.append(syllable_positions[separator] * 4)
+    pieces.append(np.full(int(separator.sum()), SEPARATOR_PIECE, dtype=np.int64))
+    separated_words = syllable_words[run_starts[separated_runs]]
+    keys.append(word_ends[separated_words] * 4)
+    pieces.append(np.full(separated_words.size, SEPARATOR_PIECE, dtype=np.int64))
+
+    keys.append(spaces * 4 + 2)
+    pieces.append(np.full(spaces.size, SPACE_PIECE, dtype=np.int64))
+
+    keys.append(word_starts[scalar_words] * 4)
+    pieces.append(np.arange(scalar_words.size, dtype=np.int64) + len(pool))
+    pool.extend([canonical_word(text[start:end]) for start, end in
+                 zip(word_starts[scalar_words].tolist(), word_ends[scalar_words].tolist())])
+
+    # The output is assembled from the pool, so the profile only has to be
+    # applied to the distinct pieces
+    pool = [apply_profile(piece, profile) for piece in pool]
+
+    keys = np.concatenate(keys)
+    pieces = np.concatenate(pieces)
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    pieces = pieces[order]
+
+    # Gather the code points of the pieces from the pool
+    pool_lengths = np.array([len(tmp) for tmp in pool], dtype=np.int64)
+    pool_starts = np.concatenate(([0], np.cumsum(pool_lengths)[:-1]))
+    pool_codes = np.frombuffer(u"".join(pool).encode('utf-32-le', 'surrogatepass'),
+                               dtype=np.uint32)
+
+    piece_lengths = pool_lengths[pieces]
+    offsets = np.concatenate(([0], np.cumsum(piece_lengths)))
+    gather = np.arange(offsets[-1], dtype=np.int64) - \
+        np.repeat(offsets[:-1] - pool_starts[pieces], piece_lengths)
+    output = pool_codes[gather].tobytes().decode('utf-32-le', 'surrogatepass')
+
+    splits = offsets[np.searchsorted(keys, text_starts * 4)].tolist() + [len(output)]
+    return [output[start:end] for start, end in zip(splits[:-1], splits[1:])]
+
+
+# Same result as converter_many(sentences, forScrivener, output_format,
+# normalization, profile), for large batches of sentences
+def converter_bulk(sentences, forScrivener=False, output_format='python',
+                   normalization='strip', profile=None):
+    profile = resolve_profile(forScrivener, profile)
+    if np is None:
+        return converter_many(sentences, forScrivener, output_format, normalization, profile)
+
+    sentences = list(sentences)
+    normalized = normalize_many(sentences, normalization)
+
+    # Group the sentences into chunks of about BULK_CHUNK_SIZE characters
+    converted = []
+    chunk = []
+    size = 0
+    try:
+        for sentence in normalized:
+            chunk.append(sentence)
+            size += len(sentence) + 1
+            if size >= BULK_CHUNK_SIZE:
+                converted.extend(convert_texts(chunk, profile))
+                chunk = []
+                size = 0
+        if chunk:
+            converted.extend(convert_texts(chunk, profile))
+    except MissingGlyphError:
+        # Raise the same error as the regular engine, i.e. for the first word
+        # without glyphs
+        return converter_many(sentences, forScrivener, output_format, normalization, profile)
+
+    return [(glyphs, encode(glyphs, output_format)) for glyphs in converted]
@@ -0,0 +1,280 @@
+# This module holds the word-level memoization cache used by the converter.
+# Conversion is a pure function of the word (the render profiles are applied
+# to the canonical glyphs afterwards), and natural text repeats the same few
+# hundred words over and over, so caching the canonical glyphs per word turns
+# most of the work into a dict lookup.
+#
+# The in-memory cache can be backed by a persistent store shared by several
+# processes (see SQLiteWordStore), so new workers start warm instead of
+# converting the same words again.
+
+import atexit
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+# Least-recently-used cache with a fixed capacity. The counters can be read at
+# runtime through stats() to check whether the capacity fits the workload.
+class WordCache:
+    def __init__(self, capacity=4096, max_word_length=64):
+        self.capacity = capacity
+        # Pathologically long words are converted but never stored, so a single
+        # oversized input cannot push the useful entries out of the cache.
+        self.max_word_length = max_word_length
+        self.enabled = True
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.backend = None
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    # Returns the cached value for the key, or None on a miss. Misses are
+    # looked up in the backend, if any.
+    def get(self, key):
+        if not self.enabled:
+            return None
+
+        try:
+            value = self._entries[key]
+        except KeyError:
+            value = None
+            if self.backend is not None:
+                value = self.backend.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._store(key, value)
+            self.hits += 1
+            return value
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if not self.enabled or self.capacity <= 0:
+            return
+        if len(key) > self.max_word_length:
+            return
+
+        self._store(key, value)
+        if self.backend is not None:
+            self.backend.put(key, value)
+
+    def _store(self, key, value):
+        if self.capacity <= 0:
+            return
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        self._evict()
+
+    def _evict(self):
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    # Change the capacity, dropping the least recently used entries if needed.
+    def resize(self, capacity):
+        self.capacity = capacity
+        self._evict()
+
+    # Turn the cache on or off. Disabling it also drops every entry.
+    def enable(self, enabled=True):
+        self.enabled = enabled
+        if not enabled:
+            self._entries.clear()
+
+    def clear(self, reset_stats=False):
+        self._entries.clear()
+        if reset_stats:
+            self.hits = self.misses = self.evictions = 0
+
+    # Read and write through a persistent backend. With warm, the most
+    # recently used entries of the backend are loaded right away.
+    def attach(self, backend, warm=True):
+        self.backend = backend
+        if warm and self.enabled:
+            for key, value in reversed(backend.recent(self.capacity)):
+                self._store(key, value)
+
+    def detach(self):
+        backend = self.backend
+        self.backend = None
+        if backend is not None:
+            backend.flush()
+        return backend
+
+    def stats(self):
+        stats = {
+            "enabled": self.enabled,
+            "capacity": self.capacity,
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+        if self.backend is not None:
+            stats["backend"] = self.backend.stats()
+        return stats
+
+
+# Persistent store of converted words in an SQLite database on local disk,
+# shared by every process opening the same file (e.g. the workers of a WSGI
+# server). Rows are keyed on the engine version along with the word, so a
+# change to the conversion tables invalidates them
+# automatically; rows of other versions are deleted when the store is opened.
+#
+# Writes (and the last-use times of the rows read) are buffered and written in
+# batches of flush_every; once the store holds more than max_entries rows, the
+# least recently used tenth of them is deleted.
+class SQLiteWordStore:
+    def __init__(self, path, version, max_entries=1000000, flush_every=64, timeout=5.0):
+        self.path = path
+        self.version = version
+        self.max_entries = max_entries
+        self.flush_every = flush_every
+        self.timeout = timeout
+
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+        self._pending = {}
+        self._touched = set()
+        self._rows = 0
+        self._connection = None
+        self._pid = None
+        self._lock = threading.RLock()
+
+        with self._lock:
+            self._connect()
+        atexit.register(self.flush)
+
+    # The connection of the current process. A connection inherited from the
+    # parent of a forked worker is never reused.
+    def _connect(self):
+        if self._connection is not None and self._pid == os.getpid():
+            return self._connection
+
+        connection = sqlite3.connect(self.path, timeout=self.timeout,
+                                     isolation_level=None, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("CREATE TABLE IF NOT EXISTS words ("
+                           "version TEXT NOT NULL, word TEXT NOT NULL, "
+                           "glyphs TEXT NOT NULL, used REAL NOT NULL, "
+                           "PRIMARY KEY (version, word))")
+        connection.execute("CREATE INDEX IF NOT EXISTS words_used ON words (used)")
+        connection.execute("DELETE FROM words WHERE version != ?", (self.version,))
+        self._rows = connection.execute("SELECT COUNT(*) FROM words").fetchone()[0]
+        if self._rows > self.max_entries:
+            self._evict(connection)
+
+        self._connection = connection
+        self._pid = os.getpid()
+        self._pending.clear()
+        self._touched.clear()
+        return connection
+
+    # Returns the stored glyphs of the word, or None.
+    def get(self, key):
+        with self._lock:
+            value = self._pending.get(key)
+            if value is None:
+                row = self._connect().execute(
+                    "SELECT glyphs FROM words WHERE version = ? AND word = ?",
+                    (self.version, key)).fetchone()
+                if row is None:
+                    self.misses += 1
+                    return None
+                value = row[0]
+                self._touched.add(key)
+
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._connect()
+            self._pending[key] = value
+            if len(self._pending) + len(self._touched) >= self.flush_every:
+                self.flush()
+
+    def flush(self):
+        with self._lock:
+            if not self._pending and not self._touched:
+                return
+            connection = self._connect()
+            now = time.time()
+
+            with connection:
+                connection.execute("BEGIN")
+                connection.executemany(
+                    "INSERT OR REPLACE INTO words VALUES (?, ?, ?, ?)",
+                    [(self.version, word, value, now)
+                     for word, value in self._pending.items()])
+                connection.executemany(
+                    "UPDATE words SET used = ? WHERE version = ? AND word = ?",
+                    [(now, self.version, word) for word in self._touched])
+
+            self.writes += len(self._pending)
+            self._rows += len(self._pending)
+            self._pending.clear()
+            self._touched.clear()
+
+            if self._rows > self.max_entries:
+                self._evict(connection)
+
+    def _evict(self, connection):
+        self._rows = connection.execute("SELECT COUNT(*) FROM words").fetchone()[0]
+        excess = self._rows - self.max_entries
+        if excess <= 0:
+            return
+
+        excess += self.max_entries // 10
+        connection.execute("DELETE FROM words WHERE rowid IN "
+                           "(SELECT rowid FROM words ORDER BY used LIMIT ?)", (excess,))
+        self.evictions += excess
+        self._rows = connection.execute("SELECT COUNT(*) FROM words").fetchone()[0]
+
+    # The most recently used entries, most recent first
+    def recent(self, limit):
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT word, glyphs FROM words WHERE version = ? "
+                "ORDER BY used DESC LIMIT ?", (self.version, limit)).fetchall()
+        return rows
+
+    def clear(self):
+        with self._lock:
+            self._connect().execute("DELETE FROM words")
+            self._pending.clear()
+            self._touched.clear()
+            self._rows = 0
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            if self._connection is not None and self._pid == os.getpid():
+                self._connection.close()
+            self._connection = None
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "rows": self._rows + len(self._pending),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "evictions": self.evictions,
+        }
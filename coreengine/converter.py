@@ -16,8 +16,17 @@
 #   OpenOffice, can be mitigated using double separator ("==")
 #   Tested case: Inputting "c-=la=ee" becomes "c-=lee"
 
-import re
-# from timeit import default_timer as timer
+import hashlib
+import json
+from time import perf_counter
+
+from coreengine import instrumentation
+from coreengine.budget import ConversionBudget, assemble_within_budget, TRUNCATION_MARKER
+from coreengine.cache import WordCache, SQLiteWordStore
+from coreengine.errors import InvalidInputError, BudgetExceeded, MissingGlyphError
+from coreengine.encoders import encode
+from coreengine.normalization import Normalizer
+from coreengine.result import ConversionResult, OFFSET_ARRAYS, offset_array
 
 # Defines base character groups of Proto-Altekhsnan writing system
 characterGroups = {
@@ -56,76 +65,532 @@ regex_groups = {
     "consonants" : ''.join(characterGroups["consonants"])
 }
 
-# First, the input is separated into individual words.
-def separate_words(sentence):
+# Define dictionaries for glyph replacement
+halfSizeSubstitution = {
+    'horizontal' : {
+        'a' : '\ue006',
+        'e' : '\ue007',
+        'i' : '\ue008',
+        'o' : '\ue009',
+        'u' : '\ue00a',
+        'ee' : '\ue00b', '\u00e9' : '\ue00b',
+        'hh' : '\ue00c', '\ue000' : '\ue00c',
+        'nn' : '\ue00d', '\ue001' : '\ue00d',
+        'th' : '\ue00e', '\ue002' : '\ue00e',
+        'eu' : '\ue00f', '\ue003' : '\ue00f',
+
+        'b' : '\ue016',
+        'c' : '\ue017',
+        'd' : '\ue018',
+        'f' : '\ue019', 'h' : '\ue019',
+        'g' : '\ue01a',
+        'j' : '\ue01b',
+        'k' : '\ue01c', 'q' : '\ue01c',
+        'l' : '\ue01d', 'r' : '\ue01d',
+        'm' : '\ue01e',
+        'n' : '\ue01f',
+        'p' : '\ue020',
+        's' : '\ue021',
+        'x' : '\ue022', 'sy' : '\ue022',
+        't' : '\ue023',
+        'v' : '\ue024', 'w' : '\ue024',
+        'y' : '\ue025',
+        'ng' : '\ue026', '\ue004' : '\ue026',
+        'ny' : '\ue027', '\ue005' : '\ue027',
+    },
+
+    'vertical' : {
+        'e' : '\ue010',
+        'i' : '\ue011',
+        'o' : '\ue012',
+        'u' : '\ue013',
+        '-' : '\ue015',
+        'ee' : '\ue014', '\u00e9' : '\ue014',
+        'hh' : '\ue03a', '\ue000' : '\ue03a',
+        'nn' : '\ue03b', '\ue001' : '\ue03b',
+        'th' : '\ue03c', '\ue002' : '\ue03c',
+        'eu' : '\ue03d', '\ue003' : '\ue03d',
+
+        'b' : '\ue028',
+        'c' : '\ue029',
+        'd' : '\ue02a',
+        'f' : '\ue02b', 'h' : '\ue02b',
+        'g' : '\ue02c',
+        'j' : '\ue02d',
+        'k' : '\ue02e', 'q' : '\ue02e',
+        'l' : '\ue02f', 'r' : '\ue02f',
+        'm' : '\ue030',
+        'n' : '\ue031',
+        'p' : '\ue032',
+        's' : '\ue033',
+        'x' : '\ue034', 'sy' : '\ue034',
+        't' : '\ue035',
+        'v' : '\ue036', 'w' : '\ue036',
+        'y' : '\ue037',
+        'ng' : '\ue038', '\ue004' : '\ue038',
+        'ny' : '\ue039', '\ue005' : '\ue039',
+    },
+}
+
+thirdSizeSubstitution = {
+    'horizontal' : {
+        'a' : '\ue05a',
+        'e' : '\ue05b',
+        'i' : '\ue05c',
+        'o' : '\ue05d',
+        'u' : '\ue05e',
+        'ee' : '\ue05f', '\u00e9' : '\ue05f',
+        'hh' : '\ue060', '\ue000' : '\ue060',
+        'nn' : '\ue061', '\ue001' : '\ue061',
+        'th' : '\ue062', '\ue002' : '\ue062',
+        'eu' : '\ue063', '\ue003' : '\ue063',
+
+        'b' : '\ue064',
+        'c' : '\ue065',
+        'd' : '\ue066',
+        'f' : '\ue067', 'h' : '\ue067',
+        'g' : '\ue068',
+        'j' : '\ue069',
+        'k' : '\ue06a', 'q' : '\ue06a',
+        'l' : '\ue06b', 'r' : '\ue06b',
+        'm' : '\ue06c',
+        'n' : '\ue06d',
+        'p' : '\ue06e',
+        's' : '\ue06f',
+        'x' : '\ue072', 'sy' : '\ue072',
+        't' : '\ue070',
+        'v' : '\ue071', 'w' : '\ue071',
+        'y' : '\ue073',
+        'ng' : '\ue074', '\ue004' : '\ue074',
+        'ny' : '\ue075', '\ue005' : '\ue075',
+    },
+
+    'vertical' : {
+        'e' : '\ue076',
+        'i' : '\ue077',
+        'o' : '\ue078',
+        'u' : '\ue079',
+        '-' : '\ue091',
+        'ee' : '\ue07a', '\u00e9' : '\ue07a',
+        'hh' : '\ue07b', '\ue000' : '\ue07b',
+        'nn' : '\ue07c', '\ue001' : '\ue07c',
+        'th' : '\ue07d', '\ue002' : '\ue07d',
+        'eu' : '\ue07e', '\ue003' : '\ue07e',
+
+        'b' : '\ue07f',
+        'c' : '\ue080',
+        'd' : '\ue081',
+        'f' : '\ue082', 'h' : '\ue082',
+        'g' : '\ue083',
+        'j' : '\ue084',
+        'k' : '\ue085', 'q' : '\ue085',
+        'l' : '\ue086', 'r' : '\ue086',
+        'm' : '\ue087',
+        'n' : '\ue088',
+        'p' : '\ue089',
+        's' : '\ue08a',
+        'x' : '\ue08c', 'sy' : '\ue08c',
+        't' : '\ue08b',
+        'v' : '\ue08d', 'w' : '\ue08d',
+        'y' : '\ue08e',
+        'ng' : '\ue08f', '\ue004' : '\ue08f',
+        'ny' : '\ue090', '\ue005' : '\ue090',
+    },
+}
+
+quarterSizeSubstitution = {
+    'e' : '\ue03e',
+    'i' : '\ue03f',
+    'o' : '\ue040',
+    'u' : '\ue041',
+    '-' : '\ue059',
+    'ee' : '\ue042', '\u00e9' : '\ue042',
+    'hh' : '\ue043', '\ue000' : '\ue043',
+    'nn' : '\ue044', '\ue001' : '\ue044',
+    'th' : '\ue045', '\ue002' : '\ue045',
+    'eu' : '\ue046', '\ue003' : '\ue046',
+
+    'b' : '\ue047',
+    'c' : '\ue048',
+    'd' : '\ue049',
+    'f' : '\ue04a', 'h' : '\ue04a',
+    'g' : '\ue04b',
+    'j' : '\ue04c',
+    'k' : '\ue04d', 'q' : '\ue04d',
+    'l' : '\ue04e', 'r' : '\ue04e',
+    'm' : '\ue04f',
+    'n' : '\ue050',
+    'p' : '\ue051',
+    's' : '\ue052',
+    'x' : '\ue053', 'sy' : '\ue053',
+    't' : '\ue054',
+    'v' : '\ue055', 'w' : '\ue055',
+    'y' : '\ue056',
+    'ng' : '\ue057', '\ue004' : '\ue057',
+    'ny' : '\ue058', '\ue005' : '\ue058',
+}
+
+# The 'h', 'n', and 'th' vowels, which join the consonant before them
+special_vowels = ('\ue000', '\ue001', '\ue002')
+
+# Scrivener renders the full-size 'h', 'n', and 'th' vowels improperly, so the
+# standalone glyphs are swapped for their alternate code points
+scrivenerSubstitution = {
+    '\ue000' : '\ue092',
+    '\ue001' : '\ue093',
+    '\ue002' : '\ue094',
+}
+
+# Changes made to the converted glyphs for each target application. The engine
+# produces a single canonical glyph stream (the one for applications with
+# OpenType support), and the profiles are applied to it afterwards, so the
+# cached words serve every target.
+# * 'scrivener' swaps the code points of the full-size 'h', 'n', and 'th'
+# * 'renpy' escapes the characters Ren'Py treats as text tags and
+#   substitutions (none of the glyphs use them so far)
+# * 'no-separator' drops the "==" workaround for the font bug
+renderProfiles = {
+    'opentype' : {},
+    'scrivener' : scrivenerSubstitution,
+    'renpy' : {'{' : '{{', '[' : '[['},
+    'no-separator' : {'=' : None},
+}
+
+# ---------------------------------------------------------------------------
+# Compiled conversion plan
+#
+# Everything below is derived from the tables above exactly once, at import
+# time, so the conversion stages only perform lookups instead of rebuilding
+# dictionaries and regex patterns for every word, syllable, and cluster.
+# ---------------------------------------------------------------------------
+
+# Character classes of the syllable tokenizer. A syllable is one of, in order
+# of priority:
+# 1 - The '=' separator
+# 2 - A consonant followed by a vowel. The special consonants 'ng', 'ny' and
+#       'sy' are written as 'n' or 's' followed by their tail letters, and
+#       't' and 's' are not regular consonants since 'th' and 'sy' exist
+# 3 - 't' followed by a vowel, including 'h' (i.e. 'th')
+# 4 - A vowel on its own: 'e' with its tail ('ee', 'eu', ...), 'nn' or 'hh'
+#       (unless preceded by another 'n' or 'h'), or a single-letter vowel
+# Characters which cannot start a syllable are skipped.
+
+# Digraphs which are replaced by a single character, grouped by their first letter
+digraph_tails = {}
+for digraph in single_char_substitute:
+    digraph_tails.setdefault(digraph[0], set()).add(digraph[1])
+
+single_vowel_set = frozenset(
+    [ch for ch in characterGroups["a"] + ''.join(characterGroups["non-a"])
+     if ch < '\ue000' and ch not in digraph_tails] + [characterGroups["vr"]])
+e_vowel_tail_set = frozenset(digraph_tails['e'])
+doubled_vowels = ('n', 'h')
+t_vowel_set = single_vowel_set | {'h'}
+special_consonant_tails = {
+    'n' : frozenset(digraph_tails['n']) - {'n'},
+    's' : frozenset(digraph_tails['s']),
+}
+# Letters which are never treated as the consonant of a consonant + vowel syllable
+non_consonant_set = single_vowel_set | {'e', 'n', 's', 't'}
+
+# Final form of each matched syllable, filled in as the tokenizer meets them.
+# Bounded so that junk input cannot grow it forever.
+syllable_forms = {}
+SYLLABLE_FORMS_LIMIT = 4096
+
+# Transition table of the tokenizer: maps the previous character followed by
+# the next SYLLABLE_WINDOW characters of a word to (characters consumed, final
+# syllable or None). A syllable match only depends on the character before it
+# and on the characters it covers, so whenever the match ends inside the window
+# the entry can be reused for every word. Entries are filled in on first use;
+# the ones at the start of a word (without a previous character) are kept apart.
+SYLLABLE_WINDOW = 4
+syllable_transitions = {}
+initial_syllable_transitions = {}
+SYLLABLE_TRANSITIONS_LIMIT = 65536
+
+# Character classes used to decide the shape of a syllable. These mirror the
+# character sets of regex_groups, so membership tests give the same answers as
+# the "^[...](?![...])" and "^[...](?=[...])" patterns they replace.
+consonant_set = frozenset(regex_groups["consonants"])
+non_a_vowel_set = frozenset(regex_groups["vowels_non_a"])
+syllable_initial_set = frozenset(regex_groups["consonants"] + regex_groups["vowels_all"])
+
+# A syllable is either written as a single glyph laid out horizontally (e.g.
+# 'b', 'a', '\ue000') or as a consonant with a vowel stacked vertically on top
+# of it (e.g. 'bi'). Anything else cannot be rendered and is dropped.
+SHAPE_HORIZONTAL = 'horizontal'
+SHAPE_VERTICAL = 'vertical'
+
+def syllable_shape(syllable):
+    if not syllable or syllable[0] not in syllable_initial_set:
+        return None
+    if len(syllable) > 1 and syllable[1] in non_a_vowel_set:
+        return SHAPE_VERTICAL if syllable[0] in consonant_set else None
+    return SHAPE_HORIZONTAL
+
+# Glyph size used for each (syllables in cluster, syllable shape) combination.
+# A lone horizontal syllable keeps its full-size glyph, i.e. the syllable itself.
+glyphSizes = {
+    (3, SHAPE_HORIZONTAL) : 'third',
+    (3, SHAPE_VERTICAL) : 'third',
+    (2, SHAPE_HORIZONTAL) : 'half',
+    (2, SHAPE_VERTICAL) : 'quarter',
+    (1, SHAPE_HORIZONTAL) : None,
+    (1, SHAPE_VERTICAL) : 'half',
+}
+
+# Flat (size, orientation, token) -> glyph lookup table. The quarter-size glyphs
+# only exist in the stacked form, hence they are filed under 'vertical'.
+def build_glyph_table():
+    table = {}
+
+    for size, substitution in (('half', halfSizeSubstitution),
+                               ('third', thirdSizeSubstitution),
+                               ('quarter', {'vertical': quarterSizeSubstitution})):
+        for orientation, glyphs in substitution.items():
+            for token, glyph in glyphs.items():
+                table[(size, orientation, token)] = glyph
+
+    return table
+
+glyphTable = build_glyph_table()
+
+# Revision of the conversion rules implemented in code. Bump it whenever a
+# change to the code alters the output for some input.
+ENGINE_REVISION = 3
+
+# Fingerprint of the conversion rules and tables. Anything derived from the
+# output of the converter (HTTP caches, persistent caches, ...) should be keyed
+# on it, so it is invalidated automatically whenever the tables change.
+def engine_fingerprint():
+    tables = [ENGINE_REVISION, characterGroups, single_char_substitute,
+              halfSizeSubstitution, thirdSizeSubstitution, quarterSizeSubstitution,
+              renderProfiles]
+    encoded = json.dumps(tables, sort_keys=True, ensure_ascii=True)
+    return hashlib.sha256(encoded.encode('ascii')).hexdigest()[:16]
+
+ENGINE_VERSION = engine_fingerprint()
+
+# Characters the converter can handle. '<' and '>' are in the font, but are
+# not rendered by the converter yet (see the known issues).
+supportedCharacters = frozenset(regex_groups["vowels_all"] + regex_groups["consonants"]
+                                + characterGroups["separator"])
+input_normalizer = Normalizer(supportedCharacters)
+
+# Lowercase the input and fold or strip the characters which are not supported
+# (see coreengine.normalization). In strict mode unsupported characters raise
+# InvalidInputError instead, before any conversion work is done; offset is
+# added to the reported positions.
+def normalize_input(text, normalization='strip', offset=0):
+    timing = instrumentation.timing
+    if timing:
+        start = perf_counter()
+
+    normalized = input_normalizer.normalize(text, normalization, offset)
+
+    if timing:
+        instrumentation.record("normalization", start, len(normalized))
+
+    return normalized
+
+# First, the input is normalized and separated into individual words.
+def separate_words(sentence, normalization='strip'):
+    input2 = normalize_input(sentence, normalization)
+
+    timing = instrumentation.timing
+    if timing:
+        start = perf_counter()
+
     words = []
-    input2 = str(sentence).lower()
 
     if input2.find(" ") != -1:
         words = input2.split(" ")
     else:
         words.append(input2)
 
+    if timing:
+        instrumentation.record("word_split", start, len(words))
+
     return words
 
-# The next step is to break down each word into syllables in Proto-Altekhsnan
-def separate_syllables_regex(word):
+# Returns the end of the vowel starting at index, or -1 if there is none
+def match_vowel(word, index, length):
+    if index >= length:
+        return -1
+
+    ch = word[index]
+    if ch == 'e':
+        index += 1
+        while index < length and word[index] in e_vowel_tail_set:
+            index += 1
+        return index
+    if ch in single_vowel_set:
+        return index + 1
+    if (ch in doubled_vowels and index + 1 < length and word[index + 1] == ch
+            and (index == 0 or word[index - 1] != ch)):
+        return index + 2
+
+    return -1
+
+# Returns the end of the syllable starting at index, or -1 if no syllable
+# starts there
+def match_syllable(word, index, length):
+    ch = word[index]
+    if ch == '=':
+        return index + 1
+
+    # Consonant followed by a vowel
+    if ch in special_consonant_tails:
+        tails = special_consonant_tails[ch]
+        end = index + 1
+        while end < length and word[end] in tails:
+            end += 1
+        end = match_vowel(word, end, length)
+        if end != -1:
+            return end
+    elif ch not in non_consonant_set:
+        end = match_vowel(word, index + 1, length)
+        if end != -1:
+            return end
+    # 't' followed by a vowel, including 'th'
+    elif ch == 't' and index + 1 < length:
+        next_ch = word[index + 1]
+        if next_ch == 'e':
+            return match_vowel(word, index + 1, length)
+        if next_ch == 'n' and index + 2 < length and word[index + 2] == 'n':
+            return index + 3
+        if next_ch in t_vowel_set:
+            return index + 2
+
+    # Vowel on its own
+    return match_vowel(word, index, length)
+
+# Substitute several characters such as "th" with their Unicode variant to make
+# clustering easier, then remove the 'a' of syllables not in modified form
+# (e.g. 'ha') to make conversion easier.
+def syllable_form(raw):
+    syllable = raw
+
+    # Only the first digraph found (in the order of single_char_substitute) is replaced
+    for ch in single_char_substitute:
+        if ch in syllable:
+            syllable = syllable.replace(ch, single_char_substitute[ch])
+            break
+
+    if len(syllable) > 1 and syllable[-1] == 'a' and not consonant_set.isdisjoint(syllable):
+        syllable = syllable[:-1]
+
+    if len(syllable_forms) < SYLLABLE_FORMS_LIMIT:
+        syllable_forms[raw] = syllable
+
+    return syllable
+
+# Match the syllable starting at index with the state machine, and store the
+# result in the transition table if it does not depend on characters past the
+# window, i.e. the match ends inside the window, or the word ends before the
+# window does (so the key is shorter than any full window).
+def scan_syllable(word, index, length, transitions, key):
+    end = match_syllable(word, index, length)
+    if end == -1:
+        entry = (1, None)
+    else:
+        raw = word[index:end]
+        syllable = syllable_forms.get(raw)
+        if syllable is None:
+            syllable = syllable_form(raw)
+        entry = (end - index, syllable)
+
+    window_end = index + SYLLABLE_WINDOW
+    if (window_end > length or -1 < end < window_end) and \
+            len(transitions) < SYLLABLE_TRANSITIONS_LIMIT:
+        transitions[key] = entry
+
+    return entry
+
+# The next step is to break down each word into syllables in Proto-Altekhsnan.
+# The word is scanned once from left to right: every syllable is looked up in
+# the transition table (or matched by the state machine above), and joined with
+# the consonant before it in case of the vowels h, n, and th.
+def tokenize_syllables(word):
     syllables = []
 
-    syllable = ''
-
-    # The priority is as follows:
-    # 1 - Special consonants - nga, nya, sya - vowels a, e, i, o, u, eu, n, h, e-acute
-    #       For s* (s and sy), this means s does not need to be included in regular consonants
-    #       Ditto for t, since it's possible for it to be 'th' (becoming vowel)
-    # 2 - Regular consonants followed by vowel (minus 'nnn' and 'hhh')
-    # 3 - Special vowels - h, n, th, e-acute, eu
-    # 4 - Regular vowels
-    rgx_pattern_vowels = 'e[eu]*|(?<!n)(nn)|(?<!h)(hh)|[aiou\u00e9-]' # th cannot be put here due to its complicated position
-    rgx_pattern_sp_consonants = 'n[gy]*|sy*' # ng*, ny*, n*, sy*, s*
-    rgx_pattern_t = 't(e[eu]*|nn|[ahiou\u00e9-])' # tee* (with e-acute), teu*, tn, t*
-    rgx_pattern_consonants = '[^aeinostu\u00e9-]'
-
-    # =|((n[gy]*|sy*|[^aeinostu\u00e9 =-])(e[eu]*|(?<!n)(nn)|(?<!h)(hh)|[aiou\u00e9-]))|(t(e[eu]*|nn|[ahiou\u00e9-]))|(e[eu]*|(?<!n)(nn)|(?<!h)(hh)|[aiou\u00e9-])
-    rgx_pattern_full = str('=' + '|' + '(' + '(({0}|{1})({2}))' + '|' + '({3})'
-                            + '|' + '({4})' + ')') \
-        .format(rgx_pattern_sp_consonants, rgx_pattern_consonants,
-            rgx_pattern_vowels, rgx_pattern_t, rgx_pattern_vowels)
-
-    for syl in re.finditer(rgx_pattern_full, word):
-        syllable = syl.group(0)
-
-        print("Possible syllable groups found: ", syl.groups())
-
-        # To make clustering easier, substitute several characters such as "th" with their
-        # Unicode variant
-        # Must be done in this way because Python is a huge jerk
-        ch = [i for i in list(single_char_substitute.keys()) if i in syllable]
-        if ch:
-            syllable = syllable.replace(ch[0], single_char_substitute[ch[0]])
-
-
-        # If the syllable is not in modified form (e.g. 'ha'), remove the 'a' to make
-        # conversion easier
-        if len(syllable) > 1 and any(cons in syllable for cons in characterGroups['consonants']) and syllable[-1] == 'a':
-            syllable = syllable[:-1]
-
-        syllables.append(syllable)
-
-    # for consonant followed by vowels h, n, and th, join the separated consonant with the vowel.
-    for index in range(len(syllables)):
-        # To handle accidentally choosing the last item because of the -1 thing
-        prevIndex = index-1 if (index - 1 >= 0) else 0
-
-        if (len(syllables[prevIndex]) == 1 and syllables[prevIndex]
-            in characterGroups["consonants"]) and (syllables[index] in
-            ("\ue000", "\ue001", "\ue002")):
-            syllables[prevIndex] = ''.join(syllables[prevIndex:index+1])
-            syllables[index] = ''
-            syllables.remove('')
+    index = 0
+    length = len(word)
+    tracing = instrumentation.tracing
+
+    while index < length:
+        if index:
+            key = word[index - 1:index + SYLLABLE_WINDOW]
+            transitions = syllable_transitions
+        else:
+            key = word[:SYLLABLE_WINDOW]
+            transitions = initial_syllable_transitions
+
+        entry = transitions.get(key)
+        if entry is None:
+            entry = scan_syllable(word, index, length, transitions, key)
+
+        index += entry[0]
+        syllable = entry[1]
+        if syllable is None:
+            continue
+
+        if tracing:
+            instrumentation.trace("syllabification", syllable)
+
+        # For consonant followed by vowels h, n, and th, join the separated consonant with the vowel.
+        if (syllable in special_vowels and syllables and len(syllables[-1]) == 1
+                and syllables[-1] in consonant_set):
+            syllables[-1] += syllable
+        else:
+            syllables.append(syllable)
 
     return syllables
 
+# Kept for callers of the former regex-based implementation
+separate_syllables_regex = tokenize_syllables
+
+# Same as tokenize_syllables(), along with the start and end of every syllable
+# in the word. A consonant joined with the 'h', 'n', or 'th' vowel after it
+# spans both.
+def locate_syllables(word):
+    syllables = []
+    starts = []
+    ends = []
+
+    index = 0
+    length = len(word)
+
+    while index < length:
+        if index:
+            key = word[index - 1:index + SYLLABLE_WINDOW]
+            transitions = syllable_transitions
+        else:
+            key = word[:SYLLABLE_WINDOW]
+            transitions = initial_syllable_transitions
+
+        entry = transitions.get(key)
+        if entry is None:
+            entry = scan_syllable(word, index, length, transitions, key)
+
+        start = index
+        index += entry[0]
+        syllable = entry[1]
+        if syllable is None:
+            continue
+
+        if (syllable in special_vowels and syllables and len(syllables[-1]) == 1
+                and syllables[-1] in consonant_set):
+            syllables[-1] += syllable
+            ends[-1] = index
+        else:
+            syllables.append(syllable)
+            starts.append(start)
+            ends.append(index)
+
+    return syllables, starts, ends
+
 
 # The next step is to break down each word into syllables in Proto-Altekhsnan
 # def separate_syllables(word):
@@ -235,288 +700,480 @@ def separate_syllables_regex(word):
 def cluster_syllables(syllables):
     clusters = []
 
-    # Prioritize clustering based on availability of separators
+    # Prioritize clustering based on availability of separators. Each '='
+    # starts a new cluster; commas and empty syllables never end up in one,
+    # as if the syllables were joined with ',' and split on '=' and ','.
     if u'=' in syllables:
-        clusters = [syl.split(',') for syl in (','.join(syllables)).split('=')]
+        cluster = []
+        clusters.append(cluster)
+
+        for syllable in syllables:
+            if syllable == u'=':
+                cluster = []
+                clusters.append(cluster)
+            elif u'=' in syllable or u',' in syllable:
+                for index, part in enumerate(syllable.split(u'=')):
+                    if index:
+                        cluster = []
+                        clusters.append(cluster)
+                    cluster.extend([piece for piece in part.split(u',') if piece])
+            elif syllable:
+                cluster.append(syllable)
 
     # Otherwise, we have to do manual clustering
     else:
-        while len(syllables) > 0:
-            # If the first three syllables has four or less characters, immediately
-            # cluster them.
-            if len(''.join(syllables[:3])) <= 4:
-                clusters.append(syllables[:3])
-                syllables = syllables[3:]
-            else:
-                clusters.append(syllables[:2])
-                syllables = syllables[2:]
+        index = 0
+        count = len(syllables)
 
+        while index < count:
+            # If the next three syllables have four or less characters,
+            # immediately cluster them.
+            group = syllables[index:index + 3]
+            if len(''.join(group)) > 4:
+                group = group[:2]
+            index += len(group)
 
-    # Delete empty members from the split
-    for cluster in clusters:
-        while '' in cluster:
-            cluster.remove('')
+            # Delete empty members
+            if u'' in group:
+                group = [syl for syl in group if syl]
+            clusters.append(group)
 
-    print("Final syllable clusters: ", clusters)
+    if instrumentation.tracing:
+        instrumentation.trace("clustering", clusters)
 
     return clusters
 
+# Glyph(s) of a single syllable in a cluster of syllable_count syllables.
+# Syllables which cannot be rendered give an empty string, and those missing
+# from the glyph tables raise MissingGlyphError.
+def syllable_glyph(syllable, syllable_count):
+    shape = syllable_shape(syllable)
+    if shape is None or (syllable_count, shape) not in glyphSizes:
+        return ''
+
+    size = glyphSizes[(syllable_count, shape)]
+    try:
+        if shape == SHAPE_HORIZONTAL:
+            if size is None: # Full-size glyph, i.e. the syllable itself
+                return syllable
+            return glyphTable[(size, shape, syllable)]
+
+        return glyphTable[(size, shape, syllable[0])] + glyphTable[(size, shape, syllable[1])]
+    except KeyError:
+        raise MissingGlyphError(syllable, syllable_count) from None
+
+# Every syllable the glyph tables can render: the horizontal glyphs on their
+# own, and every consonant paired with a stacked vowel
+def renderable_syllables():
+    horizontal = set()
+    consonants = set()
+    vowels = set()
+
+    for size, orientation, token in glyphTable:
+        if orientation == SHAPE_HORIZONTAL:
+            horizontal.add(token)
+        elif token in consonant_set:
+            consonants.add(token)
+        elif token in non_a_vowel_set:
+            vowels.add(token)
+
+    syllables = {token for token in horizontal if syllable_shape(token) == SHAPE_HORIZONTAL}
+    syllables.update(consonant + vowel for consonant in consonants for vowel in vowels)
+
+    return syllables
+
+# Precomputed glyphs of every renderable syllable, keyed on the syllable count
+# of the cluster, so converting a cluster takes one lookup per syllable.
+# Anything else (e.g. unrenderable syllables) goes through syllable_glyph()
+# instead.
+def build_syllable_glyphs():
+    syllables = renderable_syllables()
+
+    return {syllable_count: {syllable: syllable_glyph(syllable, syllable_count)
+                             for syllable in syllables}
+            for syllable_count in (1, 2, 3)}
+
+syllableGlyphs = build_syllable_glyphs()
+
+# Translation tables of the render profiles, for str.translate()
+profileTables = {name: str.maketrans(table) for name, table in renderProfiles.items()}
+PROFILES = tuple(renderProfiles)
+scrivenerTable = profileTables['scrivener']
+
+# The render profile of the options of a conversion. An explicit profile takes
+# precedence over the forScrivener flag.
+def resolve_profile(forScrivener=False, profile=None):
+    if profile is None:
+        return 'scrivener' if forScrivener else 'opentype'
+    if not isinstance(profile, str) or profile not in profileTables:
+        raise ValueError("Unknown profile {!r}, expected one of: {}.".format(
+            profile, ", ".join(PROFILES)))
+    return profile
+
+# Adapt canonical glyphs to the target application of the profile, in a single
+# pass over the text
+def apply_profile(glyphs, profile='opentype'):
+    table = profileTables.get(profile)
+    if table is None:
+        table = profileTables[resolve_profile(profile=profile)]
+    if not table:
+        return glyphs
+    return glyphs.translate(table)
+
 # This function is intended to perform the actual conversion of the syllables
-def convert_cluster(cluster, forScrivener=False):
+def cluster_glyphs(cluster, forScrivener=False):
 
-    # Define dictionaries for glyph replacement
-    halfSizeSubstitution = {
-        'horizontal' : {
-            'a' : '\ue006',
-            'e' : '\ue007',
-            'i' : '\ue008',
-            'o' : '\ue009',
-            'u' : '\ue00a',
-            'ee' : '\ue00b', '\u00e9' : '\ue00b',
-            'hh' : '\ue00c', '\ue000' : '\ue00c',
-            'nn' : '\ue00d', '\ue001' : '\ue00d',
-            'th' : '\ue00e', '\ue002' : '\ue00e',
-            'eu' : '\ue00f', '\ue003' : '\ue00f',
-
-            'b' : '\ue016',
-            'c' : '\ue017',
-            'd' : '\ue018',
-            'f' : '\ue019', 'h' : '\ue019',
-            'g' : '\ue01a',
-            'j' : '\ue01b',
-            'k' : '\ue01c', 'q' : '\ue01c',
-            'l' : '\ue01d', 'r' : '\ue01d',
-            'm' : '\ue01e',
-            'n' : '\ue01f',
-            'p' : '\ue020',
-            's' : '\ue021',
-            'x' : '\ue022', 'sy' : '\ue022',
-            't' : '\ue023',
-            'v' : '\ue024', 'w' : '\ue024',
-            'y' : '\ue025',
-            'ng' : '\ue026', '\ue004' : '\ue026',
-            'ny' : '\ue027', '\ue005' : '\ue027',
-        },
-
-        'vertical' : {
-            'e' : '\ue010',
-            'i' : '\ue011',
-            'o' : '\ue012',
-            'u' : '\ue013',
-            '-' : '\ue015',
-            'ee' : '\ue014', '\u00e9' : '\ue014',
-            'hh' : '\ue03a', '\ue000' : '\ue03a',
-            'nn' : '\ue03b', '\ue001' : '\ue03b',
-            'th' : '\ue03c', '\ue002' : '\ue03c',
-            'eu' : '\ue03d', '\ue003' : '\ue03d',
-
-            'b' : '\ue028',
-            'c' : '\ue029',
-            'd' : '\ue02a',
-            'f' : '\ue02b', 'h' : '\ue02b',
-            'g' : '\ue02c',
-            'j' : '\ue02d',
-            'k' : '\ue02e', 'q' : '\ue02e',
-            'l' : '\ue02f', 'r' : '\ue02f',
-            'm' : '\ue030',
-            'n' : '\ue031',
-            'p' : '\ue032',
-            's' : '\ue033',
-            'x' : '\ue034', 'sy' : '\ue034',
-            't' : '\ue035',
-            'v' : '\ue036', 'w' : '\ue036',
-            'y' : '\ue037',
-            'ng' : '\ue038', '\ue004' : '\ue038',
-            'ny' : '\ue039', '\ue005' : '\ue039',
-        },
-    }
-
-    thirdSizeSubstitution = {
-        'horizontal' : {
-            'a' : '\ue05a',
-            'e' : '\ue05b',
-            'i' : '\ue05c',
-            'o' : '\ue05d',
-            'u' : '\ue05e',
-            'ee' : '\ue05f', '\u00e9' : '\ue05f',
-            'hh' : '\ue060', '\ue000' : '\ue060',
-            'nn' : '\ue061', '\ue001' : '\ue061',
-            'th' : '\ue062', '\ue002' : '\ue062',
-            'eu' : '\ue063', '\ue003' : '\ue063',
-
-            'b' : '\ue064',
-            'c' : '\ue065',
-            'd' : '\ue066',
-            'f' : '\ue067', 'h' : '\ue067',
-            'g' : '\ue068',
-            'j' : '\ue069',
-            'k' : '\ue06a', 'q' : '\ue06a',
-            'l' : '\ue06b', 'r' : '\ue06b',
-            'm' : '\ue06c',
-            'n' : '\ue06d',
-            'p' : '\ue06e',
-            's' : '\ue06f',
-            'x' : '\ue072', 'sy' : '\ue072',
-            't' : '\ue070',
-            'v' : '\ue071', 'w' : '\ue071',
-            'y' : '\ue073',
-            'ng' : '\ue074', '\ue004' : '\ue074',
-            'ny' : '\ue075', '\ue005' : '\ue075',
-        },
-
-        'vertical' : {
-            'e' : '\ue076',
-            'i' : '\ue077',
-            'o' : '\ue078',
-            'u' : '\ue079',
-            '-' : '\ue091',
-            'ee' : '\ue07a', '\u00e9' : '\ue07a',
-            'hh' : '\ue07b', '\ue000' : '\ue07b',
-            'nn' : '\ue07c', '\ue001' : '\ue07c',
-            'th' : '\ue07d', '\ue002' : '\ue07d',
-            'eu' : '\ue07e', '\ue003' : '\ue07e',
-
-            'b' : '\ue07f',
-            'c' : '\ue080',
-            'd' : '\ue081',
-            'f' : '\ue082', 'h' : '\ue082',
-            'g' : '\ue083',
-            'j' : '\ue084',
-            'k' : '\ue085', 'q' : '\ue085',
-            'l' : '\ue086', 'r' : '\ue086',
-            'm' : '\ue087',
-            'n' : '\ue088',
-            'p' : '\ue089',
-            's' : '\ue08a',
-            'x' : '\ue08c', 'sy' : '\ue08c',
-            't' : '\ue08b',
-            'v' : '\ue08d', 'w' : '\ue08d',
-            'y' : '\ue08e',
-            'ng' : '\ue08f', '\ue004' : '\ue08f',
-            'ny' : '\ue090', '\ue005' : '\ue090',
-        },
-    }
-
-    quarterSizeSubstitution = {
-        'e' : '\ue03e',
-        'i' : '\ue03f',
-        'o' : '\ue040',
-        'u' : '\ue041',
-        '-' : '\ue059',
-        'ee' : '\ue042', '\u00e9' : '\ue042',
-        'hh' : '\ue043', '\ue000' : '\ue043',
-        'nn' : '\ue044', '\ue001' : '\ue044',
-        'th' : '\ue045', '\ue002' : '\ue045',
-        'eu' : '\ue046', '\ue003' : '\ue046',
-
-        'b' : '\ue047',
-        'c' : '\ue048',
-        'd' : '\ue049',
-        'f' : '\ue04a', 'h' : '\ue04a',
-        'g' : '\ue04b',
-        'j' : '\ue04c',
-        'k' : '\ue04d', 'q' : '\ue04d',
-        'l' : '\ue04e', 'r' : '\ue04e',
-        'm' : '\ue04f',
-        'n' : '\ue050',
-        'p' : '\ue051',
-        's' : '\ue052',
-        'x' : '\ue053', 'sy' : '\ue053',
-        't' : '\ue054',
-        'v' : '\ue055', 'w' : '\ue055',
-        'y' : '\ue056',
-        'ng' : '\ue057', '\ue004' : '\ue057',
-        'ny' : '\ue058', '\ue005' : '\ue058',
-    }
-
-    joined = ''.join(cluster)
-    character_count = len(joined)
     syllable_count = len(cluster)
-    print("Syllable count in cluster ", cluster, ": ", syllable_count)
+    if instrumentation.tracing:
+        instrumentation.trace("glyph_substitution", (cluster, syllable_count))
 
+    glyphs = syllableGlyphs.get(syllable_count, {})
     new_syllables = []
 
     # Check the length of the cluster. Four-character cluster takes priority.
     for syllable in cluster:
-        if syllable_count == 3: # Use the third-size
-            if bool(re.match('^[' + regex_groups["consonants"] + regex_groups["vowels_all"] + '](?![' + regex_groups["vowels_non_a"] +'])', syllable)):
-                new_syllables.append(thirdSizeSubstitution['horizontal'][syllable])
-            elif bool(re.match('^[' + regex_groups["consonants"] + '](?=[' + regex_groups["vowels_non_a"] +'])', syllable)):
-                new_syllables.append(thirdSizeSubstitution['vertical'][syllable[0]] + thirdSizeSubstitution['vertical'][syllable[1]])
-            else:
-                pass
-        elif syllable_count == 2: # Use either the quarter-size or horizontal half-size
-            if bool(re.match('^[' + regex_groups["consonants"] + regex_groups["vowels_all"] + '](?![' + regex_groups["vowels_non_a"] +'])', syllable)):
-                new_syllables.append(halfSizeSubstitution['horizontal'][syllable])
-            elif bool(re.match('^[' + regex_groups["consonants"] + '](?=[' + regex_groups["vowels_non_a"] +'])', syllable)):
-                new_syllables.append(quarterSizeSubstitution[syllable[0]] + quarterSizeSubstitution[syllable[1]])
-            else:
-                pass
-        elif syllable_count == 1:
-            if bool(re.match('^[' + regex_groups["consonants"] + regex_groups["vowels_all"] + '](?![' + regex_groups["vowels_non_a"] +'])', syllable)):
-                if forScrivener and (syllable in ('\ue000', '\ue001', '\ue002')):
-                    if syllable == '\ue000':
-                        new_syllables.append('\ue092')
-                    elif syllable == '\ue001':
-                        new_syllables.append('\ue093')
-                    elif syllable == '\ue002':
-                        new_syllables.append('\ue094')
-                else:
-                    new_syllables.append(syllable)
-            elif bool(re.match('^[' + regex_groups["consonants"] + '](?=[' + regex_groups["vowels_non_a"] +'])', syllable)):
-                new_syllables.append(halfSizeSubstitution['vertical'][syllable[0]] + halfSizeSubstitution['vertical'][syllable[1]])
-            else:
-                pass
-
-
-    unicode_code_points = []
-
-    # For the Unicode representation
-    for ch in "".join(new_syllables):
-        unicode_code_points.append(
-            str(
-                hex(ord(ch))
-            ).replace('0x', '\\u')
-        )
+        glyph = glyphs.get(syllable)
+        if glyph is None:
+            glyph = syllable_glyph(syllable, syllable_count)
+        new_syllables.append(glyph)
 
-    return ("".join(new_syllables), "".join(unicode_code_points))
+    converted = "".join(new_syllables)
+    if forScrivener:
+        return converted.translate(scrivenerTable)
+    return converted
 
+# Same as cluster_glyphs(), along with the Unicode (Python) code points
+def convert_cluster(cluster, forScrivener=False):
+    converted = cluster_glyphs(cluster, forScrivener)
+    return (converted, encode(converted))
+
+
+# Word-level memoization cache of the canonical glyphs, keyed on the word. Use
+# word_cache.resize(), word_cache.enable(False), word_cache.clear() and
+# word_cache.stats() to tune or inspect it at runtime.
+word_cache = WordCache()
+
+# Read and write the word cache through a SQLite database at path, shared by
+# all processes using the same file. Entries are keyed on ENGINE_VERSION, so
+# entries of older conversion tables are never returned. Returns the store.
+def enable_persistent_cache(path, warm=True, **options):
+    store = SQLiteWordStore(path, ENGINE_VERSION, **options)
+    word_cache.attach(store, warm)
+    return store
+
+# Convert a single word, returning its glyphs (with the cluster separators)
+def convert_word(word, forScrivener=False):
+    glyphs = canonical_word(word)
+    if forScrivener:
+        return glyphs.translate(scrivenerTable)
+    return glyphs
+
+# Canonical glyphs of a single word, for any render profile
+def canonical_word(word):
+    cached = word_cache.get(word)
+    if cached is not None:
+        return cached
+
+    glyphs = []
+
+    timing = instrumentation.timing
+    if timing:
+        start = perf_counter()
+
+    # Separate the word into syllables, then group into clusters
+    syllables = tokenize_syllables(word)
+    if timing:
+        start = instrumentation.record("syllabification", start, len(syllables))
+
+    clusters = cluster_syllables(syllables)
+    if timing:
+        start = instrumentation.record("clustering", start, len(clusters))
+
+    # Finally, generate the converted word
+    for cluster in clusters:
+        glyphs.append(cluster_glyphs(cluster))
+        glyphs.append("==") # FIXME: dirty fix for the text display due to the font bug
+
+    if timing:
+        instrumentation.record("glyph_substitution", start, len(clusters))
+
+    result = "".join(glyphs)
+    word_cache.put(word, result)
+
+    return result
+
+# Join the converted words of a sentence back together, separated by spaces
+def assemble_words(words, convert):
+    return u" ".join([convert(word) for word in words])
+
+# Budget of the conversions which are not given their own (see
+# coreengine.budget). Unlimited unless set with set_conversion_budget().
+conversion_budget = ConversionBudget()
+
+def set_conversion_budget(budget):
+    global conversion_budget
+    conversion_budget = budget if budget is not None else ConversionBudget()
+
+def get_conversion_budget():
+    return conversion_budget
+
+# The actual system. Returns the converted glyphs along with their code points
+# in the requested output format (see coreengine.encoders); pass
+# output_format='none' to skip the code points altogether. The glyphs are
+# adapted to the render profile, which defaults to 'scrivener' with
+# forScrivener and 'opentype' otherwise. The work is bounded by the budget
+# (conversion_budget by default).
+def converter(sentence, forScrivener=False, output_format='python', normalization='strip',
+              profile=None, budget=None):
+    profile = resolve_profile(forScrivener, profile)
+    budget = budget or conversion_budget
+
+    # Separate the sentence into words, then convert each of them (or fetch
+    # them from the cache)
+    if budget.unlimited:
+        words = separate_words(sentence, normalization)
+        glyphs = assemble_words(words, canonical_word)
+    else:
+        deadline = budget.deadline()
+        sentence, truncated = budget.limit_input(sentence)
+        words = separate_words(sentence, normalization)
+        glyphs = assemble_within_budget(words, canonical_word, budget, deadline, truncated)[0]
+    glyphs = apply_profile(glyphs, profile)
+
+    return glyphs, encode(glyphs, output_format)
+
+# Normalize many sentences at once. In strict mode every sentence is validated
+# before any of them is converted; the error then has the index of the first
+# invalid sentence.
+def normalize_many(sentences, normalization='strip'):
+    normalized = []
+    for index, sentence in enumerate(sentences):
+        try:
+            normalized.append(normalize_input(sentence, normalization))
+        except InvalidInputError as error:
+            error.index = index
+            raise
+
+    return normalized
+
+# Convert many sentences at once. Words are converted at most once per batch,
+# even if they fall out of (or are too long for) the shared word cache. The
+# budget applies to the batch as a whole: max_chars bounds the total length of
+# the sentences, and in truncate mode the sentences after an overrun are left
+# with the truncation marker only.
+def converter_many(sentences, forScrivener=False, output_format='python',
+                   normalization='strip', profile=None, budget=None):
+    profile = resolve_profile(forScrivener, profile)
+    budget = budget or conversion_budget
+    converted_words = {}
+
+    if not budget.unlimited:
+        deadline = budget.deadline()
+        sentences, cut = budget.limit_batch(list(sentences))
+    normalized = normalize_many(sentences, normalization)
+
+    def convert(word):
+        try:
+            return converted_words[word]
+        except KeyError:
+            result = converted_words[word] = canonical_word(word)
+            return result
+
+    results = []
+    truncated = False
+    for index, sentence in enumerate(normalized):
+        try:
+            if budget.unlimited:
+                glyphs = assemble_words(sentence.split(u" "), convert)
+            else:
+                # Once a sentence is cut short, none of the following ones is
+                # converted
+                glyphs, truncated = assemble_within_budget(
+                    [] if truncated else sentence.split(u" "), convert, budget, deadline,
+                    truncated or index == cut)
+        except (BudgetExceeded, MissingGlyphError) as error:
+            error.index = index
+            raise
+        glyphs = apply_profile(glyphs, profile)
+        results.append((glyphs, encode(glyphs, output_format)))
+
+    return results
+
+# Offsets of the syllables and clusters of a single word, relative to the
+# word and to its glyphs (see coreengine.result). Returns the glyphs, the
+# (starts, ends, glyph starts, glyph ends) of the syllables, and the (start,
+# end, glyph start, glyph end, first syllable, last syllable + 1) of every
+# cluster.
+def locate_word(word, table):
+    syllables, starts, ends = locate_syllables(word)
+    clusters = cluster_syllables(syllables)
+    separated = u'=' in syllables
+    count = len(syllables)
+    glyph_starts = [0] * count
+    glyph_ends = [0] * count
+    cluster_spans = []
+
+    pieces = []
+    position = 0
+    index = 0
+    # The "==" convert_word() adds after every cluster
+    separator = u"==".translate(table)
+
+    for number, cluster in enumerate(clusters):
+        # With separators, every cluster after the first one starts at a '='
+        # (whose glyphs are empty) and ends before the next one
+        if separated and number:
+            glyph_starts[index] = glyph_ends[index] = position
+            index += 1
+
+        first = index
+        glyph_start = position
+        size = len(cluster)
+        glyphs = syllableGlyphs.get(size, {})
+        members = 0
+
+        while index < count and (syllables[index] != u'=' if separated else members < size):
+            syllable = syllables[index]
+            # cluster_syllables() splits syllables on commas when there are
+            # separators (only possible without normalization)
+            if separated and u',' in syllable:
+                parts = [part for part in syllable.split(u',') if part]
+            else:
+                parts = [syllable] if syllable else []
+
+            glyph_starts[index] = position
+            for part in parts:
+                glyph = glyphs.get(part)
+                if glyph is None:
+                    glyph = syllable_glyph(part, size)
+                glyph = glyph.translate(table)
+                pieces.append(glyph)
+                position += len(glyph)
+            glyph_ends[index] = position
+            members += len(parts)
+            index += 1
+
+        if index > first:
+            source_start, source_end = starts[first], ends[index - 1]
+        else:
+            source_start = source_end = ends[first - 1] if first else 0
+        cluster_spans.append((source_start, source_end, glyph_start, position, first, index))
+
+        pieces.append(separator)
+        position += len(separator)
+
+    return u"".join(pieces), (starts, ends, glyph_starts, glyph_ends), cluster_spans
+
+# Same as converter(), returning a ConversionResult which maps every word,
+# syllable, and cluster of the (normalized) input to the range of glyphs it
+# produced. Repeated words are only located once per call.
+def converter_structured(sentence, forScrivener=False, output_format='python',
+                         normalization='strip', profile=None, budget=None):
+    table = profileTables[resolve_profile(forScrivener, profile)]
+    budget = budget or conversion_budget
+    deadline = budget.deadline()
+    sentence, truncated = budget.limit_input(sentence)
+    source = normalize_input(sentence, normalization)
+
+    offsets = {name: offset_array() for name in OFFSET_ARRAYS}
+    word_starts = offsets["word_starts"]
+    word_ends = offsets["word_ends"]
+    word_glyph_starts = offsets["word_glyph_starts"]
+    word_glyph_ends = offsets["word_glyph_ends"]
+    word_syllables = offsets["word_syllables"]
+    word_clusters = offsets["word_clusters"]
+    syllable_arrays = [offsets[name] for name in ("syllable_starts", "syllable_ends",
+                                                  "syllable_glyph_starts", "syllable_glyph_ends")]
+    cluster_arrays = [offsets[name] for name in ("cluster_starts", "cluster_ends",
+                                                 "cluster_glyph_starts", "cluster_glyph_ends",
+                                                 "cluster_syllable_starts",
+                                                 "cluster_syllable_ends")]
+
+    located = {}
+    pieces = []
+    start = 0
+    glyph_start = 0
+    syllable_count = 0
+
+    for position, word in enumerate(source.split(u" ")):
+        if not budget.allows(word, position, deadline):
+            truncated = True
+            break
+        if position:
+            pieces.append(u" ")
+            glyph_start += 1
+
+        entry = located.get(word)
+        if entry is None:
+            entry = located[word] = locate_word(word, table)
+        glyphs, syllables, clusters = entry
+
+        word_starts.append(start)
+        word_ends.append(start + len(word))
+        word_glyph_starts.append(glyph_start)
+        word_glyph_ends.append(glyph_start + len(glyphs))
+        word_syllables.append(syllable_count)
+        word_clusters.append(len(cluster_arrays[0]))
+
+        for values_array, values, base in zip(syllable_arrays, syllables,
+                                              (start, start, glyph_start, glyph_start)):
+            values_array.extend([value + base for value in values])
+        for span in clusters:
+            for values_array, value, base in zip(
+                    cluster_arrays, span, (start, start, glyph_start, glyph_start,
+                                           syllable_count, syllable_count)):
+                values_array.append(value + base)
+
+        pieces.append(glyphs)
+        start += len(word) + 1
+        glyph_start += len(glyphs)
+        syllable_count += len(syllables[0])
+
+    word_syllables.append(syllable_count)
+    word_clusters.append(len(cluster_arrays[0]))
+
+    if truncated:
+        pieces.append((u" " if pieces else u"") + TRUNCATION_MARKER)
+    glyphs = u"".join(pieces)
+    return ConversionResult(source, glyphs, encode(glyphs, output_format), truncated, **offsets)
+
+# Convert a block of complete words, keeping the line breaks of the input.
+# offset is the position of the block in the input, for strict mode errors.
+def convert_block(block, forScrivener=False, normalization='strip', offset=0, profile=None):
+    return apply_profile(u"\n".join([
+        assemble_words(line.split(u" "), canonical_word)
+        for line in normalize_input(block, normalization, offset).split(u"\n")]),
+        resolve_profile(forScrivener, profile))
+
+# Convert a text stream incrementally, yielding (glyphs, code points) pairs as
+# the input is read. Each chunk is cut after its last space or line break, and
+# the unfinished word is carried over to the next chunk, so memory use only
+# depends on the chunk size. Every line is converted exactly as converter()
+# would convert it.
+def iter_convert(stream, forScrivener=False, chunk_size=65536, output_format='python',
+                 normalization='strip', profile=None):
+    profile = resolve_profile(forScrivener, profile)
+    pending = u''
+    consumed = 0
 
-# The actual system
-def converter(sentence, forScrivener=False):
-    # start = timer()
-    words = []
-    syllables = []
-    clusters = []
-
-    final_string = u''
-    unicode_code_points = u''
-
-    # Separate the sentence into words.
-    words = separate_words(sentence)
-
-    # For each word, separate into syllables, then group into clusters
-    for word in words:
-        syllables = separate_syllables_regex(word)
-        clusters = cluster_syllables(syllables)
-
-        # Finally, generate the converted word along with their Unicode code points
-        for cluster in clusters:
-            tmp = convert_cluster(cluster, forScrivener)
-            final_string += tmp[0]
-            final_string += "==" # FIXME: dirty fix for the text display due to the font bug
-            unicode_code_points += tmp[1]
-
-        # Add space if it's not the end of the sentence
-        if word != words[-1]:
-            final_string += u" "
-            # unicode_code_points += "\\u0020"
-            unicode_code_points += "\u0020"
-
-    # stop = timer()
-    # print("Time elapsed: " + str(stop-start))
-
-    return final_string, unicode_code_points
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+
+        text = pending + chunk
+        cut = max(text.rfind(" "), text.rfind("\n")) + 1
+        pending = text[cut:]
+
+        if cut:
+            glyphs = convert_block(text[:cut], False, normalization, consumed, profile)
+            consumed += cut
+            yield glyphs, encode(glyphs, output_format)
+
+    # The words of the last line are never followed by a separator
+    if pending:
+        glyphs = convert_block(pending, False, normalization, consumed, profile)
+        yield glyphs, encode(glyphs, output_format)
 
 if __name__ == '__main__':
     while True:
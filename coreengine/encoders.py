@@ -0,0 +1,79 @@
+# Output formats of the converted text. The converter only produces the glyph
+# string; every other representation is derived from it in a single pass when
+# (and only if) a caller asks for it:
+#
+#   python    the historical "Unicode (Python)" output, e.g. '\ue00b'
+#   unicode   fixed-width escapes, e.g. '\uE00B' (or '\U0001F600')
+#   html      numeric character references, e.g. '&#xE00B;'
+#   json      the glyph text as a JSON string literal
+#   utf-8     the glyph text encoded as UTF-8 bytes
+#   utf-16    the glyph text encoded as UTF-16 bytes (with a byte order mark)
+#   none      nothing at all
+#
+# The escape formats describe the glyphs only: the '=' separators the
+# converter adds as a workaround for the font are left out, while spaces and
+# line breaks are kept as they are.
+
+import json
+
+SEPARATOR = '='
+LITERALS = (' ', '\n')
+
+
+# str.translate table whose entries are created on first use, so escaping a
+# string is a single pass over it no matter which characters it contains
+class EscapeTable(dict):
+    def __init__(self, escape):
+        super().__init__()
+        self.escape = escape
+        self[ord(SEPARATOR)] = None
+        for ch in LITERALS:
+            self[ord(ch)] = ch
+
+    def __missing__(self, code_point):
+        escaped = self[code_point] = self.escape(code_point)
+        return escaped
+
+
+def python_escape(code_point):
+    return str(hex(code_point)).replace('0x', '\\u')
+
+def unicode_escape(code_point):
+    if code_point > 0xffff:
+        return '\\U{:08X}'.format(code_point)
+    return '\\u{:04X}'.format(code_point)
+
+def html_escape(code_point):
+    return '&#x{:X};'.format(code_point)
+
+
+escapeTables = {
+    'python' : EscapeTable(python_escape),
+    'unicode' : EscapeTable(unicode_escape),
+    'html' : EscapeTable(html_escape),
+}
+
+encoders = {
+    'json' : lambda glyphs: json.dumps(glyphs),
+    'utf-8' : lambda glyphs: glyphs.encode('utf-8'),
+    'utf-16' : lambda glyphs: glyphs.encode('utf-16'),
+    'none' : lambda glyphs: None,
+}
+
+# Formats whose output is text (as opposed to bytes)
+TEXT_FORMATS = ('python', 'unicode', 'html', 'json', 'none')
+FORMATS = tuple(escapeTables) + tuple(encoders)
+
+
+def encode(glyphs, output_format='python'):
+    table = escapeTables.get(output_format)
+    if table is not None:
+        return glyphs.translate(table)
+
+    try:
+        encoder = encoders[output_format]
+    except KeyError:
+        raise ValueError("Unknown output format {!r}, expected one of: {}"
+                         .format(output_format, ", ".join(FORMATS)))
+
+    return encoder(glyphs)
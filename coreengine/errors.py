@@ -0,0 +1,82 @@
+# Errors raised by the converter for input it refuses to convert. They derive
+# from ValueError, so callers which already catch bad input keep working, and
+# as_dict() gives the details in a form that can be returned by an API.
+
+
+class ConversionError(ValueError):
+    def as_dict(self):
+        return {"error": str(self)}
+
+
+# Raised in strict mode for characters the font has no glyphs for. offsets are
+# the positions of the offending characters in the input.
+class InvalidInputError(ConversionError):
+    def __init__(self, offsets, characters):
+        self.offsets = offsets
+        self.characters = characters
+        super().__init__("Unsupported character(s) {} at offset(s) {}".format(
+            ", ".join(sorted(set(map(repr, characters)))),
+            ", ".join(map(str, offsets[:10])) + (", ..." if len(offsets) > 10 else "")))
+
+    def as_dict(self):
+        return {"error": str(self), "offsets": self.offsets,
+                "characters": self.characters}
+
+
+# Raised for syllables the glyph tables have no glyph for, e.g. 'ze', or a
+# stacked vowel missing at the size of its cluster. Survives pickling, so it
+# also reaches the caller from the worker processes of converter_parallel().
+class MissingGlyphError(ConversionError):
+    def __init__(self, syllable, syllable_count):
+        self.syllable = syllable
+        self.syllable_count = syllable_count
+        super().__init__("No glyph for syllable {!r} in a cluster of {} syllable(s)".format(
+            syllable, syllable_count))
+
+    def __reduce__(self):
+        return type(self), (self.syllable, self.syllable_count)
+
+    def as_dict(self):
+        return {"error": str(self), "syllable": self.syllable,
+                "cluster_size": self.syllable_count}
+
+
+# Raised when a conversion goes over its budget (see coreengine.budget)
+class BudgetExceeded(ConversionError):
+    pass
+
+
+# The input is longer than the max_chars of the budget
+class InputTooLarge(BudgetExceeded):
+    def __init__(self, length, limit):
+        self.length = length
+        self.limit = limit
+        super().__init__("Input of {} characters is over the limit of {}".format(length, limit))
+
+    def as_dict(self):
+        return {"error": str(self), "length": self.length, "limit": self.limit}
+
+
+# A word is longer than the max_word_length of the budget. position is the
+# number of the word in the input.
+class WordTooLong(BudgetExceeded):
+    def __init__(self, position, length, limit):
+        self.position = position
+        self.length = length
+        self.limit = limit
+        super().__init__("Word {} has {} characters, over the limit of {}".format(
+            position, length, limit))
+
+    def as_dict(self):
+        return {"error": str(self), "position": self.position, "length": self.length,
+                "limit": self.limit}
+
+
+# The conversion took longer than the max_seconds of the budget
+class DeadlineExceeded(BudgetExceeded):
+    def __init__(self, limit):
+        self.limit = limit
+        super().__init__("Conversion did not finish within {} second(s)".format(limit))
+
+    def as_dict(self):
+        return {"error": str(self), "limit": self.limit}
@@ -0,0 +1,153 @@
+# Subsetting of the Proto-Altekhsnan font for converted text. A converted
+# passage only uses a few dozen of the glyphs of the font, so a preview can
+# load a small web font holding just those glyphs instead of the whole file.
+#
+# Requires the optional fontTools package; WOFF2 output also requires brotli,
+# otherwise the subsets are compressed as WOFF.
+#
+# The glyphs usually come from the client, so only characters the font maps
+# are accepted, up to MAX_GLYPHS_LENGTH of them, and at most max_builds subsets
+# are built at a time (each one is a full fontTools run).
+
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+
+from coreengine.errors import InvalidInputError, InputTooLarge, DeadlineExceeded
+
+try:
+    from fontTools import subset
+    from fontTools.ttLib import TTFont
+except ImportError:
+    subset = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Characters which never need a glyph
+IGNORED = ('\n',)
+
+# Longest glyph string accepted. The font has a couple hundred glyphs, and
+# glyph_string() gives each of them once.
+MAX_GLYPHS_LENGTH = 512
+
+MIMETYPES = {
+    'woff2' : 'font/woff2',
+    'woff' : 'font/woff',
+}
+
+
+# The distinct characters of the text, sorted. Texts using the same glyphs
+# share the same glyph string, and therefore the same subset.
+def glyph_string(text):
+    return u"".join(sorted(set(text).difference(IGNORED)))
+
+
+# Thread-safe, size-bounded cache of the subsets of a font, keyed by a hash of
+# the font and the glyph set. The least recently used subsets are dropped first.
+class FontSubsetter:
+    def __init__(self, path, capacity=128, flavor=None, max_builds=4):
+        self.path = path
+        self.capacity = capacity
+        self.flavor = flavor or ('woff2' if brotli is not None else 'woff')
+        self.mimetype = MIMETYPES[self.flavor]
+
+        self._font = None
+        self._digest = None
+        self._characters = None
+        self._subsets = OrderedDict()
+        self._lock = threading.Lock()
+        self._builds = threading.BoundedSemaphore(max_builds)
+
+    @property
+    def available(self):
+        return subset is not None
+
+    def _load(self):
+        if self._font is None:
+            with open(self.path, 'rb') as handle:
+                font = handle.read()
+            self._digest = hashlib.sha256(font).hexdigest()
+            self._font = font
+        return self._font
+
+    # The characters the font has glyphs for, from its cmap
+    def characters(self):
+        if subset is None:
+            raise RuntimeError("Font subsetting requires the fontTools package.")
+        if self._characters is None:
+            font = TTFont(io.BytesIO(self._load()), lazy=True)
+            self._characters = frozenset(map(chr, font.getBestCmap()))
+        return self._characters
+
+    # The glyph string of the text. Raises InputTooLarge for texts longer
+    # than MAX_GLYPHS_LENGTH, and InvalidInputError for characters the font
+    # has no glyph for.
+    def glyph_set(self, text):
+        if len(text) > MAX_GLYPHS_LENGTH:
+            raise InputTooLarge(len(text), MAX_GLYPHS_LENGTH)
+
+        characters = self.characters()
+        unsupported = [(index, ch) for index, ch in enumerate(text)
+                       if ch not in characters and ch not in IGNORED]
+        if unsupported:
+            raise InvalidInputError(*map(list, zip(*unsupported)))
+
+        return glyph_string(text)
+
+    # Hash of the font file, the output format and the glyph set of the text
+    def key(self, text):
+        glyphs = self.glyph_set(text)
+        digest = hashlib.sha256()
+        digest.update("{}:{}:".format(self._digest, self.flavor).encode('ascii'))
+        digest.update(glyphs.encode('utf-8', 'surrogatepass'))
+        return digest.hexdigest()[:32]
+
+    # Returns (key, compressed font) of the subset with the glyphs of the text.
+    # Raises RuntimeError if fontTools is not installed, the errors of
+    # glyph_set() for invalid glyphs, and DeadlineExceeded if no build slot
+    # frees up within timeout seconds.
+    def subset(self, text, timeout=None):
+        key = self.key(text)
+
+        with self._lock:
+            font = self._subsets.get(key)
+            if font is not None:
+                self._subsets.move_to_end(key)
+                return key, font
+
+        if not self._builds.acquire(timeout=timeout):
+            raise DeadlineExceeded(timeout)
+        try:
+            font = self.build(glyph_string(text))
+        finally:
+            self._builds.release()
+
+        with self._lock:
+            self._subsets[key] = font
+            while len(self._subsets) > self.capacity:
+                self._subsets.popitem(last=False)
+
+        return key, font
+
+    def build(self, glyphs):
+        if subset is None:
+            raise RuntimeError("Font subsetting requires the fontTools package.")
+
+        options = subset.Options()
+        options.flavor = self.flavor
+        # The converted glyphs are already positioned, so the OpenType (and
+        # AAT) lookups of the font are not needed
+        options.layout_features = []
+        options.drop_tables += ['FFTM', 'PfEd', 'feat', 'morx']
+        font = subset.load_font(io.BytesIO(self._load()), options)
+        subsetter = subset.Subsetter(options)
+        subsetter.populate(unicodes=[ord(ch) for ch in glyphs])
+        subsetter.subset(font)
+
+        output = io.BytesIO()
+        subset.save_font(font, output, options)
+        return output.getvalue()
@@ -0,0 +1,197 @@
+# Incremental re-conversion for live typing. A document keeps the converted
+# output of each of its words; when a span of the source text is edited, only
+# the words touching the span are converted again, and the change is reported
+# as a patch over the list of converted words:
+#
+#   {"index": 3, "removed": 1, "words": [{"text": ..., "codepoints": ...}, ...]}
+#
+# i.e. the converted words from index 3 on replace the one word at index 3.
+# The full output is the converted words joined with spaces, as in converter().
+# In strict mode an edit inserting unsupported characters is rejected with
+# InvalidInputError, and the document is left unchanged. The converted words
+# are adapted to the render profile of the document.
+#
+# Edits are bounded by the budget of the document (see coreengine.budget):
+# max_chars bounds the length of the whole document, and max_word_length and
+# the deadline apply to the words converted again. An edit over the budget
+# raises one of the BudgetExceeded errors and leaves the document unchanged,
+# whatever the mode of the budget, since a document cannot be truncated.
+#
+# The start offsets of the words up to the last edit are kept as they are, and
+# those of the words after it relative to the end of the document, so an edit
+# only shifts the offsets between the previous edit and this one instead of
+# every offset after it: typing at the same place costs the same whatever the
+# size of the document.
+
+import threading
+import uuid
+from bisect import bisect_right
+from collections import OrderedDict
+
+from coreengine.budget import ConversionBudget
+from coreengine.converter import (canonical_word, normalize_input, resolve_profile,
+                                  apply_profile, get_conversion_budget)
+from coreengine.encoders import encode
+
+
+class IncrementalDocument:
+    def __init__(self, text=u'', forScrivener=False, output_format='python',
+                 normalization='strip', profile=None, budget=None):
+        self.profile = resolve_profile(forScrivener, profile)
+        self.output_format = output_format
+        self.normalization = normalization
+        # The conversion budget of the engine unless given
+        self.budget = budget
+        self.words = [u'']
+        self.starts = [0]
+        self.converted = [canonical_word(u'')]
+        self.length = 0
+        # Index of the first word whose offset is relative to the end
+        self._split = 1
+        self._lock = threading.Lock()
+
+        self.set_text(text)
+
+    @property
+    def text(self):
+        return u" ".join(self.words)
+
+    # The converted glyphs of the whole document, along with their code points
+    # in the given output format
+    def result(self, output_format='python'):
+        glyphs = u" ".join(self.converted)
+        return glyphs, encode(glyphs, output_format)
+
+    def set_text(self, text):
+        return self.apply_edit(0, self.length, str(text))
+
+    def word_start(self, index):
+        start = self.starts[index]
+        return start if index < self._split else start + self.length
+
+    # Index of the last word starting at or before the offset
+    def find_word(self, offset):
+        later = bisect_right(self.starts, offset - self.length, self._split) - 1
+        if later >= self._split:
+            return later
+        return bisect_right(self.starts, offset, 0, self._split) - 1
+
+    # Replace the source text between start and end (character offsets) with
+    # replacement, and return the patch of the converted words. Edits of the
+    # same document are applied one at a time.
+    def apply_edit(self, start, end, replacement):
+        with self._lock:
+            return self._apply_edit(start, end, replacement)
+
+    def _apply_edit(self, start, end, replacement):
+        if not 0 <= start <= end <= self.length:
+            raise ValueError("Edit span {}-{} is outside of the document (length {})"
+                             .format(start, end, self.length))
+
+        budget = self.budget or get_conversion_budget()
+        if budget.mode != 'raise':
+            budget = ConversionBudget(budget.max_chars, budget.max_word_length,
+                                      budget.max_seconds)
+        deadline = budget.deadline()
+        length = self.length + len(replacement) - (end - start)
+        if not budget.unlimited:
+            budget.check_size(length)
+
+        if self.normalization == 'strict':
+            normalize_input(replacement, 'strict', start)
+
+        # The first and last word touching the span. A span starting or ending
+        # right after a word (i.e. on the following space) still touches it.
+        first = self.find_word(start)
+        last = self.find_word(end)
+
+        segment_start = self.word_start(first)
+        segment = u" ".join(self.words[first:last + 1])
+        segment = (segment[:start - segment_start] + replacement
+                   + segment[end - segment_start:])
+
+        words = segment.split(u" ")
+        starts = []
+        offset = segment_start
+        for word in words:
+            starts.append(offset)
+            offset += len(word) + 1
+
+        # The rest of the segment has been validated by the previous edits
+        normalization = 'strip' if self.normalization == 'strict' else self.normalization
+        converted = []
+        for position, word in enumerate(normalize_input(segment, normalization).split(u" "),
+                                        first):
+            if not budget.unlimited:
+                budget.allows(word, position, deadline)
+            converted.append(apply_profile(canonical_word(word), self.profile))
+
+        # Offsets before the edited words become absolute, those after them
+        # relative to the end, which the edit does not change
+        split = self._split
+        if split < first:
+            self.starts[split:first] = [old + self.length for old in self.starts[split:first]]
+        elif split > last + 1:
+            self.starts[last + 1:split] = [old - self.length
+                                           for old in self.starts[last + 1:split]]
+
+        self.words[first:last + 1] = words
+        self.converted[first:last + 1] = converted
+        self.starts[first:last + 1] = starts
+        self._split = first + len(words)
+        self.length = length
+
+        return {
+            "index": first,
+            "removed": last - first + 1,
+            "words": [{"text": glyphs, "codepoints": encode(glyphs, self.output_format)}
+                      for glyphs in converted],
+        }
+
+
+# Raised for ids which are not (or no longer) in a DocumentStore
+class UnknownDocument(LookupError):
+    pass
+
+
+# Thread-safe, size-bounded collection of documents, keyed by a random id.
+# The least recently used documents are dropped first. The store is only
+# locked to look documents up, so a slow edit does not hold up the others.
+class DocumentStore:
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self._documents = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, text=u'', forScrivener=False, output_format='python',
+               normalization='strip', profile=None, budget=None):
+        document = IncrementalDocument(text, forScrivener, output_format, normalization,
+                                       profile, budget)
+        document_id = uuid.uuid4().hex
+
+        with self._lock:
+            self._documents[document_id] = document
+            while len(self._documents) > self.capacity:
+                self._documents.popitem(last=False)
+
+        return document_id, document
+
+    # The document with the given id, or None
+    def get(self, document_id):
+        with self._lock:
+            document = self._documents.get(document_id)
+            if document is not None:
+                self._documents.move_to_end(document_id)
+            return document
+
+    # Apply an edit to a stored document. Raises UnknownDocument for unknown
+    # ids.
+    def edit(self, document_id, start, end, replacement):
+        document = self.get(document_id)
+        if document is None:
+            raise UnknownDocument(document_id)
+        return document.apply_edit(start, end, replacement)
+
+    def delete(self, document_id):
+        with self._lock:
+            self._documents.pop(document_id, None)
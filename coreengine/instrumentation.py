@@ -0,0 +1,78 @@
+# Opt-in instrumentation of the conversion pipeline. The engine is silent by
+# default; tracing and per-stage timing have to be switched on explicitly, and
+# while they are off the conversion stages only pay for a flag check.
+#
+# Tracing reports the intermediate results of every stage (regex groups,
+# clusters, ...) either to a user-supplied hook or to the "coreengine" logger.
+# Timing accumulates the number of calls, the number of items produced and the
+# wall-clock time spent in each stage.
+
+import logging
+from time import perf_counter
+
+logger = logging.getLogger("coreengine")
+
+# The stages of the pipeline, in order
+STAGES = ("normalization", "word_split", "syllabification", "clustering", "glyph_substitution")
+
+tracing = False
+timing = False
+
+_trace_hook = None
+
+
+class StageTimer:
+    __slots__ = ("calls", "items", "seconds")
+
+    def __init__(self):
+        self.calls = 0
+        self.items = 0
+        self.seconds = 0.0
+
+    def as_dict(self):
+        return {"calls": self.calls, "items": self.items, "seconds": self.seconds}
+
+
+stage_timers = {stage: StageTimer() for stage in STAGES}
+
+
+# Report the intermediate results of a stage. The hook is called as
+# hook(stage, data); without a hook the data is logged at DEBUG level.
+def enable_tracing(hook=None):
+    global tracing, _trace_hook
+    _trace_hook = hook
+    tracing = True
+
+def disable_tracing():
+    global tracing, _trace_hook
+    _trace_hook = None
+    tracing = False
+
+def trace(stage, data):
+    if _trace_hook is not None:
+        _trace_hook(stage, data)
+    else:
+        logger.debug("%s: %r", stage, data)
+
+
+def enable_timing(enabled=True):
+    global timing
+    timing = enabled
+
+# Add the time elapsed since start to the stage, and return the current time so
+# consecutive stages can be chained.
+def record(stage, start, items=1):
+    now = perf_counter()
+    timer = stage_timers[stage]
+    timer.calls += 1
+    timer.items += items
+    timer.seconds += now - start
+    return now
+
+def snapshot():
+    return {stage: timer.as_dict() for stage, timer in stage_timers.items()}
+
+def reset():
+    for timer in stage_timers.values():
+        timer.calls = timer.items = 0
+        timer.seconds = 0.0
@@ -0,0 +1,128 @@
+# Normalization and validation of the input, before it is separated into
+# words. The font only has glyphs for a handful of characters; anything else
+# used to go through the whole pipeline and come out as garbage (or not at
+# all). Instead, every character is mapped once by str.translate():
+#
+#   * supported characters are kept, lowercased (e.g. 'B' -> 'b'),
+#   * letters with a supported base letter are folded (e.g. 'à' -> 'a'),
+#   * anything else is stripped, or reported in strict mode.
+#
+# The mapping never creates nor removes spaces and line breaks, so the words
+# of the normalized text are the normalized words of the input.
+
+import unicodedata
+
+from coreengine.errors import InvalidInputError
+
+# strip:  drop unsupported characters
+# strict: raise InvalidInputError for unsupported characters
+# none:   lowercase only, as the converter always did
+NORMALIZATION_MODES = ('strip', 'strict', 'none')
+BOUNDARIES = (' ', '\n')
+# Entries kept by the translation tables. Latin-1 is always kept; past the
+# limit, other characters are folded again every time they are met, so junk
+# input cannot grow the tables forever.
+NORMALIZATION_TABLE_LIMIT = 4096
+
+
+# str.translate table whose entries are created on first use
+class NormalizationTable(dict):
+    def __init__(self, supported):
+        super().__init__()
+        self.supported = frozenset(supported) | frozenset(BOUNDARIES)
+
+    def __missing__(self, code_point):
+        normalized = self.fold(chr(code_point))
+        if code_point < 256 or len(self) < NORMALIZATION_TABLE_LIMIT:
+            self[code_point] = normalized
+        return normalized
+
+    def is_supported(self, text):
+        return all(ch in self.supported for ch in text)
+
+    # Returns the supported spelling of the character, or None
+    def fold(self, ch):
+        if ch in BOUNDARIES:
+            return ch
+
+        lowered = ch.lower()
+        if self.is_supported(lowered):
+            return lowered
+
+        # Drop the accents, e.g. 'À' -> 'a', or expand ligatures
+        folded = ''.join([tmp for tmp in unicodedata.normalize('NFKD', lowered)
+                          if not unicodedata.combining(tmp)])
+        if folded and self.is_supported(folded) and \
+                not any(boundary in folded for boundary in BOUNDARIES):
+            return folded
+
+        return None
+
+
+# Marks the characters which would be stripped, i.e. maps every supported
+# character to None and the others to themselves
+class RejectionTable(dict):
+    def __init__(self, table):
+        super().__init__()
+        self.table = table
+
+    def __missing__(self, code_point):
+        rejected = None if self.table[code_point] is not None else chr(code_point)
+        if code_point < 256 or len(self) < NORMALIZATION_TABLE_LIMIT:
+            self[code_point] = rejected
+        return rejected
+
+
+class Normalizer:
+    def __init__(self, supported):
+        self.table = NormalizationTable(supported)
+        self.rejections = RejectionTable(self.table)
+
+        # Latin-1 input (i.e. nearly all of it) is translated as bytes, which
+        # is an order of magnitude faster than looking every character up.
+        # Every Latin-1 character maps to at most one Latin-1 character.
+        mapping = bytearray(range(256))
+        deleted = bytearray()
+        for code_point in range(256):
+            normalized = self.table[code_point]
+            if normalized is None:
+                deleted.append(code_point)
+            else:
+                mapping[code_point] = ord(normalized)
+        self.latin1_table = bytes(mapping)
+        self.latin1_deleted = bytes(deleted)
+
+    # The offsets (plus the given offset) and characters which are not supported
+    def find_unsupported(self, text, offset=0):
+        table = self.table
+        offsets = []
+        characters = []
+        for index, ch in enumerate(text):
+            if table[ord(ch)] is None:
+                offsets.append(offset + index)
+                characters.append(ch)
+        return offsets, characters
+
+    def normalize(self, text, mode='strip', offset=0):
+        text = str(text)
+        if mode == 'none':
+            return text.lower()
+        if mode not in NORMALIZATION_MODES:
+            raise ValueError("Unknown normalization mode {!r}, expected one of: {}"
+                             .format(mode, ", ".join(NORMALIZATION_MODES)))
+
+        try:
+            encoded = text.encode('latin-1')
+        except UnicodeEncodeError:
+            pass
+        else:
+            normalized = encoded.translate(self.latin1_table, self.latin1_deleted)
+            if mode == 'strict' and len(normalized) != len(encoded):
+                raise InvalidInputError(*self.find_unsupported(text, offset))
+            return normalized.decode('latin-1')
+
+        # A second translation pass is only a fraction of the cost of running
+        # the pipeline on invalid input
+        if mode == 'strict' and text.translate(self.rejections):
+            raise InvalidInputError(*self.find_unsupported(text, offset))
+        return text.translate(self.table)
@@ -0,0 +1,51 @@
+# Parallel conversion of large documents. The input is separated into words,
+# the words are split into chunks, and the chunks are converted in a process
+# pool; the results are joined back in order. Short inputs are converted in
+# the current process, since starting a pool costs far more than converting
+# a few sentences.
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from coreengine.converter import (converter, canonical_word, separate_words,
+                                  resolve_profile, apply_profile)
+from coreengine.encoders import encode
+
+# Inputs shorter than this many characters are converted in-process
+PARALLEL_THRESHOLD = 100000
+# Number of words sent to a worker at a time
+DEFAULT_CHUNK_SIZE = 5000
+
+
+# Runs in the worker processes. Each worker keeps its own word cache, and
+# returns the canonical glyphs, whatever the render profile.
+def convert_chunk(words):
+    return u" ".join([canonical_word(word) for word in words])
+
+
+# Same result as converter(sentence, forScrivener, output_format, normalization,
+# profile). workers defaults to the number of CPUs; an existing executor can be
+# passed to avoid starting a new pool for every document.
+def converter_parallel(sentence, forScrivener=False, workers=None,
+                       chunk_size=DEFAULT_CHUNK_SIZE,
+                       threshold=PARALLEL_THRESHOLD, executor=None,
+                       output_format='python', normalization='strip', profile=None):
+    profile = resolve_profile(forScrivener, profile)
+    sentence = str(sentence)
+    if len(sentence) < threshold:
+        return converter(sentence, forScrivener, output_format, normalization, profile)
+
+    words = separate_words(sentence, normalization)
+    chunks = [words[start:start + chunk_size]
+              for start in range(0, len(words), chunk_size)]
+    if len(chunks) < 2:
+        results = [convert_chunk(words)]
+    elif executor is not None:
+        results = list(executor.map(convert_chunk, chunks))
+    else:
+        workers = min(workers or os.cpu_count() or 1, len(chunks))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(convert_chunk, chunks))
+
+    glyphs = apply_profile(u" ".join(results), profile)
+    return glyphs, encode(glyphs, output_format)
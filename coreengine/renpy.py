@@ -0,0 +1,232 @@
+# Batch conversion of the Proto-Altekhsnan passages of a Ren'Py project, e.g.
+#
+#   python -m coreengine.renpy script/ game/
+#
+# Every .rpy file under the source directory is written to the same path
+# under the output directory, with the text between {pa} and {/pa} converted
+# and wrapped in a {font} tag:
+#
+#   e "The gate reads {pa}viatrix otlium{/pa}."
+#
+# The converted scripts cannot sit next to their sources in the game
+# directory, since Ren'Py would then load every label twice, hence the
+# separate output tree (which may be the game directory itself).
+#
+# A manifest in the output directory records the size, modification time and
+# hash of every source along with the converted passages, so a rebuild only
+# reads the files which changed, and only converts the passages it has not
+# seen before.
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+
+from coreengine.converter import converter, ENGINE_VERSION
+from coreengine.errors import InvalidInputError, MissingGlyphError
+
+MANIFEST_NAME = ".pa-manifest.json"
+MANIFEST_VERSION = 1
+DEFAULT_FONT = "ProtoAltekhsnan.otf"
+
+# A passage to convert. "{{pa}" is an escaped brace in Ren'Py, not a marker.
+SPAN_PATTERN = re.compile(r"(?<!\{)\{pa\}(.*?)\{/pa\}")
+
+
+def write_atomic(path, data):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as handle:
+        handle.write(data)
+    os.replace(temporary, path)
+
+
+# Raised when a passage cannot be converted, with its location in the sources
+class PassageError(ValueError):
+    def __init__(self, path, line, error):
+        super().__init__("{}:{}: {}".format(path, line, error))
+        self.path = path
+        self.line = line
+        self.error = error
+
+
+# Raised when a converted script would overwrite its own source
+class SourceOverwriteError(ValueError):
+    pass
+
+
+class ProjectConverter:
+    def __init__(self, source, output, font=DEFAULT_FONT, normalization="strip"):
+        self.source = source
+        self.output = output
+        self.font = font
+        self.normalization = normalization
+        self.manifest_path = os.path.join(output, MANIFEST_NAME)
+
+    # Everything the output depends on besides the sources. A manifest made
+    # with other settings is discarded.
+    @property
+    def settings(self):
+        return {"manifest": MANIFEST_VERSION, "engine": ENGINE_VERSION,
+                "font": self.font, "normalization": self.normalization}
+
+    def load_manifest(self):
+        try:
+            with open(self.manifest_path, encoding="utf-8") as handle:
+                manifest = json.load(handle)
+        except (OSError, ValueError):
+            manifest = None
+
+        if not isinstance(manifest, dict):
+            return {"settings": None, "files": {}, "passages": {}}
+        return manifest
+
+    # Relative paths of the .rpy sources, leaving out the output tree if it is
+    # inside the source tree
+    def source_files(self):
+        output = os.path.realpath(self.output)
+
+        for root, dirs, files in os.walk(self.source):
+            dirs[:] = sorted(name for name in dirs
+                             if os.path.realpath(os.path.join(root, name)) != output)
+            for name in sorted(files):
+                if name.endswith(".rpy"):
+                    yield os.path.relpath(os.path.join(root, name), self.source)
+
+    def render(self, text, passages):
+        def replace(match):
+            glyphs = passages[match.group(1)]
+            if not self.font:
+                return glyphs
+            return "{{font={}}}{}{{/font}}".format(self.font, glyphs)
+
+        return SPAN_PATTERN.sub(replace, text)
+
+    # Convert the passages which are not in the manifest yet, reporting the
+    # location of the first one which cannot be converted
+    def convert_passages(self, changed, passages):
+        for path, (text, entry) in changed.items():
+            for number, line in enumerate(text.split("\n"), 1):
+                for match in SPAN_PATTERN.finditer(line):
+                    passage = match.group(1)
+                    if passage in passages:
+                        continue
+                    try:
+                        passages[passage] = converter(passage, output_format="none",
+                                                      normalization=self.normalization,
+                                                      profile="renpy")[0]
+                    except (InvalidInputError, MissingGlyphError) as error:
+                        raise PassageError(path, number, error)
+
+    # Bring the output tree up to date with the sources. Returns the number
+    # of files written, unchanged and removed, and of passages converted.
+    def build(self, force=False):
+        if os.path.realpath(self.output) == os.path.realpath(self.source):
+            raise SourceOverwriteError("The output directory is the source directory, "
+                                       "the sources would be overwritten.")
+
+        manifest = self.load_manifest()
+        # The outputs of the sources deleted since the previous build are
+        # removed even if the rebuild is forced or the settings changed
+        previous = manifest.get("files", {})
+        reusable = not force and manifest.get("settings") == self.settings
+        known = manifest.get("passages", {}) if reusable else {}
+        files = {}
+        changed = {}
+
+        for path in self.source_files():
+            source = os.path.join(self.source, path)
+            target = os.path.join(self.output, path)
+            if os.path.realpath(target) == os.path.realpath(source):
+                raise SourceOverwriteError("{} would overwrite its own source.".format(target))
+            status = os.stat(source)
+            entry = previous.get(path) if reusable else None
+
+            if (entry and entry["mtime"] == status.st_mtime_ns and entry["size"] == status.st_size
+                    and os.path.exists(target)):
+                files[path] = entry
+                continue
+
+            with open(source, "rb") as handle:
+                data = handle.read()
+            digest = hashlib.sha256(data).hexdigest()
+            updated = {"mtime": status.st_mtime_ns, "size": status.st_size, "sha256": digest}
+
+            # Only touched, e.g. by a checkout
+            if entry and entry["sha256"] == digest and os.path.exists(target):
+                files[path] = dict(entry, **updated)
+                continue
+
+            text = data.decode("utf-8")
+            updated["passages"] = sorted(set(SPAN_PATTERN.findall(text)))
+            files[path] = updated
+            changed[path] = (text, updated)
+
+        passages = dict(known)
+        self.convert_passages(changed, passages)
+
+        for path, (text, entry) in changed.items():
+            write_atomic(os.path.join(self.output, path), self.render(text, passages).encode("utf-8"))
+
+        # Outputs of deleted sources, along with the scripts Ren'Py compiled
+        # from them
+        removed = 0
+        for path in previous:
+            if path not in files:
+                target = os.path.join(self.output, path)
+                for stale in (target, target + "c"):
+                    if os.path.exists(stale):
+                        os.remove(stale)
+                removed += 1
+
+        used = set()
+        for entry in files.values():
+            used.update(entry["passages"])
+        manifest = {"settings": self.settings, "files": files,
+                    "passages": {passage: passages[passage] for passage in sorted(used)}}
+        write_atomic(self.manifest_path,
+                     json.dumps(manifest, ensure_ascii=False, indent=1).encode("utf-8"))
+
+        return {"written": len(changed), "unchanged": len(files) - len(changed),
+                "removed": removed, "converted": len(passages) - len(known)}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m coreengine.renpy",
+        description="Convert the {pa}...{/pa} passages of Ren'Py scripts into "
+                    "Proto-Altekhsnan glyphs.")
+    parser.add_argument("source", help="directory of the .rpy sources")
+    parser.add_argument("output", help="directory of the converted scripts")
+    parser.add_argument("--font", default=DEFAULT_FONT,
+                        help="font of the converted passages (default: %(default)s); "
+                             "an empty value leaves out the {font} tag")
+    parser.add_argument("--strict", action="store_true",
+                        help="reject passages with unsupported characters instead of "
+                             "stripping them")
+    parser.add_argument("--force", action="store_true",
+                        help="ignore the manifest and convert every file")
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    project = ProjectConverter(args.source, args.output, args.font,
+                               'strict' if args.strict else 'strip')
+
+    try:
+        stats = project.build(args.force)
+    except (PassageError, SourceOverwriteError) as error:
+        sys.stderr.write("error: {}\n".format(error))
+        return 1
+
+    sys.stderr.write("{written} file(s) written, {unchanged} unchanged, {removed} removed, "
+                     "{converted} passage(s) converted\n".format(**stats))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
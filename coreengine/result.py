@@ -0,0 +1,104 @@
+# Structured result of a conversion (see converter_structured()), mapping the
+# words, syllables and clusters of the input to the range of glyphs each of
+# them produced, e.g. to highlight or re-render part of a passage without
+# converting it again.
+#
+# Source offsets refer to the normalized input (source), glyph offsets to the
+# converted glyphs. The maps are kept as parallel arrays of integers rather
+# than as an object per syllable:
+#
+# * word_starts/word_ends and word_glyph_starts/word_glyph_ends span each word
+#   (the words of the input separated by spaces, as in converter())
+# * word_syllables and word_clusters hold the index of the first syllable and
+#   cluster of each word, plus the total count at the end, so word i owns
+#   syllables word_syllables[i] to word_syllables[i + 1]
+# * syllable_* span each syllable of tokenize_syllables(), including the '='
+#   separators, which produce no glyphs
+# * cluster_* span each cluster of cluster_syllables(); cluster_syllable_starts
+#   and cluster_syllable_ends give the syllables it is made of. The glyph range
+#   of a cluster leaves out the "==" following it.
+#
+# The result unpacks like the (glyphs, code points) tuple of converter().
+
+from array import array
+from bisect import bisect_left, bisect_right
+
+# Typecode of the offset arrays (unsigned, at least 32 bits)
+OFFSET_TYPECODE = 'I' if array('I').itemsize >= 4 else 'L'
+
+OFFSET_ARRAYS = (
+    "word_starts", "word_ends", "word_glyph_starts", "word_glyph_ends",
+    "word_syllables", "word_clusters",
+    "syllable_starts", "syllable_ends", "syllable_glyph_starts", "syllable_glyph_ends",
+    "cluster_starts", "cluster_ends", "cluster_glyph_starts", "cluster_glyph_ends",
+    "cluster_syllable_starts", "cluster_syllable_ends",
+)
+
+
+def offset_array(values=()):
+    return array(OFFSET_TYPECODE, values)
+
+
+class ConversionResult:
+    __slots__ = ("source", "glyphs", "codepoints", "truncated") + OFFSET_ARRAYS
+
+    def __init__(self, source, glyphs, codepoints, truncated=False, **offsets):
+        self.source = source
+        self.glyphs = glyphs
+        self.codepoints = codepoints
+        self.truncated = truncated
+        for name in OFFSET_ARRAYS:
+            setattr(self, name, offsets.get(name, offset_array()))
+
+    def __iter__(self):
+        return iter((self.glyphs, self.codepoints))
+
+    @property
+    def word_count(self):
+        return len(self.word_starts)
+
+    @property
+    def syllable_count(self):
+        return len(self.syllable_starts)
+
+    @property
+    def cluster_count(self):
+        return len(self.cluster_starts)
+
+    def word_glyphs(self, index):
+        return self.glyphs[self.word_glyph_starts[index]:self.word_glyph_ends[index]]
+
+    def syllable_glyphs(self, index):
+        return self.glyphs[self.syllable_glyph_starts[index]:self.syllable_glyph_ends[index]]
+
+    def cluster_glyphs(self, index):
+        return self.glyphs[self.cluster_glyph_starts[index]:self.cluster_glyph_ends[index]]
+
+    # The (start, end) range of the glyphs produced by the syllables
+    # overlapping the source span, or None if no syllable does
+    def glyph_range(self, start, end):
+        first = bisect_right(self.syllable_ends, start)
+        last = bisect_left(self.syllable_starts, end) - 1
+        if first > last:
+            return None
+        return self.syllable_glyph_starts[first], self.syllable_glyph_ends[last]
+
+    # The (start, end) source span of the syllables whose glyphs overlap the
+    # glyph range, or None if no syllable does
+    def source_range(self, start, end):
+        first = bisect_right(self.syllable_glyph_ends, start)
+        last = bisect_left(self.syllable_glyph_starts, end) - 1
+        # Syllables without glyphs (e.g. the '=' separators) do not count
+        while first <= last and self.syllable_glyph_starts[first] == self.syllable_glyph_ends[first]:
+            first += 1
+        while last >= first and self.syllable_glyph_starts[last] == self.syllable_glyph_ends[last]:
+            last -= 1
+        if first > last:
+            return None
+        return self.syllable_starts[first], self.syllable_ends[last]
+
+    def as_dict(self):
+        result = {"source": self.source, "text": self.glyphs, "codepoints": self.codepoints,
+                  "truncated": self.truncated}
+        result.update((name, getattr(self, name).tolist()) for name in OFFSET_ARRAYS)
+        return result
@@ -1,11 +1,50 @@
-from flask import request, redirect, url_for, render_template
+import hashlib
+import os
+
+from flask import request, redirect, url_for, render_template, jsonify
 from flask import Flask
 
-from coreengine.converter import converter
+from coreengine import instrumentation
+from coreengine.budget import ConversionBudget
+from coreengine.converter import (converter, converter_many, word_cache, ENGINE_VERSION,
+                                  enable_persistent_cache, resolve_profile,
+                                  set_conversion_budget)
+from coreengine.encoders import encode, TEXT_FORMATS
+from coreengine.errors import ConversionError, BudgetExceeded, DeadlineExceeded
+from coreengine.incremental import DocumentStore
+from coreengine.fonts import FontSubsetter, glyph_string
 
 
 app = Flask(__name__)
 
+instrumentation.enable_timing()
+
+# Documents being edited live through the incremental endpoints
+documents = DocumentStore()
+
+# Subsets of the font for the previews of the results, built by as many
+# threads at a time as the conversions of the ASGI mode
+fonts = FontSubsetter(os.path.join(app.static_folder, 'transliterator', 'css',
+                                   'ProtoAltekhsnan.otf'),
+                      max_builds=int(os.environ.get("CONVERSION_THREADS", 4)))
+FONT_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Word cache shared by the worker processes, e.g.
+#   CONVERTER_CACHE_PATH=/var/cache/transliterator/words.sqlite3 gunicorn ...
+# CONVERTER_CACHE_SIZE bounds the number of words kept on disk.
+if os.environ.get("CONVERTER_CACHE_PATH"):
+    enable_persistent_cache(os.environ["CONVERTER_CACHE_PATH"],
+                            max_entries=int(os.environ.get("CONVERTER_CACHE_SIZE", 1000000)))
+
+# Work budget of every conversion, so an oversized input cannot stall a worker.
+# Requests over the budget are answered with 413 (input or word too long) or
+# 503 (deadline exceeded).
+budget = ConversionBudget(
+    max_chars=int(os.environ.get("CONVERTER_MAX_CHARS", 200000)),
+    max_word_length=int(os.environ.get("CONVERTER_MAX_WORD_LENGTH", 10000)),
+    max_seconds=float(os.environ.get("CONVERTER_DEADLINE", 5.0)))
+set_conversion_budget(budget)
+
 @app.route('/')
 def index():
     return redirect(url_for('transliterator'))
@@ -17,20 +56,241 @@ def transliterator():
     text_result = None
     unicode_cp = None
     scrivener_option = None
+    font_url = None
+    error = None
+    status = 200
 
     if request.method == "POST":
         query = request.form["text_input"]
         scrivener_option = request.form.get("scrivener_checkbox", "off")
 
-        if scrivener_option == 'on':
-            result = converter(query, True)
+        try:
+            if scrivener_option == 'on':
+                result = converter(query, True)
+            else:
+                result = converter(query)
+        except ConversionError as rejected:
+            error = str(rejected)
+            status = error_status(rejected)
         else:
-            result = converter(query)
-        text_result = result[0]
-        print(text_result)
-        unicode_cp = result[1]
+            text_result = result[0]
+            unicode_cp = result[1]
+
+            # Preview the result with a font holding only the glyphs it uses
+            if fonts.available and text_result:
+                font_url = url_for('api_font', glyphs=glyph_string(text_result))
 
     else:
         pass
 
-    return render_template('index.html', query=query, text_result=text_result, unicode_cp=unicode_cp)
+    return render_template('index.html', query=query, text_result=text_result, unicode_cp=unicode_cp,
+                           font_url=font_url, font_format=fonts.flavor, error=error), status
+
+# Check the requested code point format (see coreengine.encoders). Only the
+# text formats can be embedded in a JSON response.
+def parse_format(value):
+    output_format = value or 'python'
+    if output_format not in TEXT_FORMATS:
+        raise ValueError("Unknown format {!r}, expected one of: {}.".format(
+            output_format, ", ".join(TEXT_FORMATS)))
+    return output_format
+
+# Check a flag of a JSON request, which has to be an actual boolean (e.g. the
+# string "false" is not false)
+def parse_flag(name, value):
+    if not isinstance(value, bool):
+        raise ValueError("Expected {!r} to be true or false.".format(name))
+    return value
+
+# Keyword arguments of the converter for the options of a request. In strict
+# mode, input with unsupported characters is rejected instead of cleaned up.
+# An explicit render profile (e.g. "renpy") takes precedence over scrivener.
+def conversion_options(scrivener=False, output_format=None, strict=False, profile=None):
+    return {"output_format": parse_format(output_format),
+            "normalization": 'strict' if parse_flag("strict", strict) else 'strip',
+            "profile": resolve_profile(parse_flag("scrivener", scrivener),
+                                       None if profile in (None, "") else profile)}
+
+# Parse the payload of a batch conversion, i.e. either a JSON array of
+# strings or an object such as {"texts": [...], "scrivener": true, "format": "html",
+# "strict": true, "profile": "renpy"}. Returns (texts, converter options), or
+# raises ValueError.
+def parse_batch(payload):
+    options = {}
+
+    if isinstance(payload, dict):
+        options = payload
+        texts = payload.get("texts")
+    else:
+        texts = payload
+
+    if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+        raise ValueError("Expected a JSON array of strings.")
+
+    return texts, conversion_options(options.get("scrivener", False), options.get("format"),
+                                     options.get("strict", False), options.get("profile"))
+
+# JSON body of a rejected conversion, e.g. the offsets of unsupported characters
+def error_details(error):
+    if isinstance(error, ConversionError):
+        details = error.as_dict()
+        if getattr(error, "index", None) is not None:
+            details["index"] = error.index
+        return details
+    return {"error": str(error)}
+
+# HTTP status of a rejected conversion
+def error_status(error):
+    if isinstance(error, DeadlineExceeded):
+        return 503
+    if isinstance(error, BudgetExceeded):
+        return 413
+    return 400
+
+# Conversion is a pure function of the engine version, the options and the
+# text, so its hash makes a strong validator for HTTP caching.
+CACHE_CONTROL = "public, max-age=86400"
+
+def conversion_etag(text, options):
+    digest = hashlib.sha256()
+    digest.update("{}:{}:{}:{}:".format(ENGINE_VERSION, options["profile"],
+                                        options["output_format"],
+                                        options["normalization"]).encode("ascii"))
+    digest.update(text.encode("utf-8", "surrogatepass"))
+    return digest.hexdigest()
+
+def is_enabled(value):
+    return (value or "").lower() in ("1", "true", "on", "yes")
+
+# Batch conversion for tooling. Accepts either a JSON array of strings, or an
+# object such as {"texts": [...], "scrivener": true, "format": "html"}, and
+# returns an array of {"text": ..., "codepoints": ...} results in the same order.
+# With "strict": true, texts with unsupported characters are answered with 400
+# and the offsets of the offending characters, as are texts with syllables the
+# font has no glyph for (with the index of the text). Batches over the budget
+# are answered with 413 or 503.
+@app.route('/api/convert', methods=['POST'])
+def api_convert():
+    try:
+        texts, options = parse_batch(request.get_json(silent=True))
+        results = converter_many(texts, **options)
+    except ValueError as error:
+        return jsonify(error_details(error)), error_status(error)
+
+    return jsonify([{"text": text, "codepoints": codepoints}
+                    for text, codepoints in results])
+
+# Cacheable conversion of a single text, e.g. /api/convert?text=viatrix&scrivener=1
+# or /api/convert?text=viatrix&profile=no-separator.
+# Answers If-None-Match with 304 Not Modified without converting anything.
+@app.route('/api/convert', methods=['GET'])
+def api_convert_cached():
+    text = request.args.get("text", "")
+    try:
+        options = conversion_options(is_enabled(request.args.get("scrivener")),
+                                     request.args.get("format"),
+                                     is_enabled(request.args.get("strict")),
+                                     request.args.get("profile"))
+    except ValueError as error:
+        return jsonify(error_details(error)), 400
+    etag = conversion_etag(text, options)
+
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        try:
+            result = converter(text, **options)
+        except ConversionError as error:
+            return jsonify(error_details(error)), error_status(error)
+        response = jsonify(text=result[0], codepoints=result[1])
+
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    return response
+
+# Web font with only the given glyphs, e.g. the characters of a conversion
+# result (see coreengine.fonts.glyph_string()). The font only depends on the
+# glyph set, so it is cached for good by the browsers. Characters the font has
+# no glyph for are answered with 400, glyph strings over MAX_GLYPHS_LENGTH with
+# 413, and builds which cannot start within the deadline of the budget with 503.
+@app.route('/api/font')
+def api_font():
+    if not fonts.available:
+        return jsonify(error="Font subsetting requires the fontTools package."), 501
+
+    glyphs = request.args.get("glyphs", "")
+    try:
+        key = fonts.key(glyphs)
+
+        if request.if_none_match.contains(key):
+            response = app.response_class(status=304)
+        else:
+            key, font = fonts.subset(glyphs, timeout=budget.max_seconds)
+            response = app.response_class(font, mimetype=fonts.mimetype)
+    except ConversionError as error:
+        return jsonify(error_details(error)), error_status(error)
+
+    response.set_etag(key)
+    response.headers["Cache-Control"] = FONT_CACHE_CONTROL
+    return response
+
+# Cumulative per-stage timers and counters of the conversion engine
+@app.route('/metrics')
+def metrics():
+    return jsonify(stages=instrumentation.snapshot(), word_cache=word_cache.stats())
+
+# Open a document for live typing. Expects {"text": ..., "scrivener": false}
+# (and optionally a code point "format", "strict" and a render "profile") and
+# returns its id along with the converted words.
+@app.route('/api/documents', methods=['POST'])
+def create_document():
+    payload = request.get_json(silent=True)
+    if payload is None:
+        payload = {}
+    if not isinstance(payload, dict):
+        return jsonify(error="Expected a JSON object."), 400
+    text = payload.get("text", "")
+    if not isinstance(text, str):
+        return jsonify(error="Expected \"text\" to be a string."), 400
+    try:
+        options = conversion_options(payload.get("scrivener", False), payload.get("format"),
+                                     payload.get("strict", False), payload.get("profile"))
+        document_id, document = documents.create(text, **options)
+    except ValueError as error:
+        return jsonify(error_details(error)), error_status(error)
+
+    output_format = options["output_format"]
+    return jsonify(id=document_id, words=[{"text": glyphs, "codepoints": encode(glyphs, output_format)}
+                                         for glyphs in document.converted])
+
+# Replace the source text between "start" and "end" with "text", and return
+# only the converted words which changed (see coreengine.incremental). Edits
+# taking the document over the budget are answered with 413 or 503, and leave
+# it unchanged.
+@app.route('/api/documents/<document_id>/edits', methods=['POST'])
+def edit_document(document_id):
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify(error="Expected a JSON object."), 400
+    start = payload.get("start")
+    end = payload.get("end", start)
+    text = payload.get("text", "")
+
+    if not isinstance(start, int) or not isinstance(end, int) or not isinstance(text, str):
+        return jsonify(error="Expected integer \"start\"/\"end\" offsets and a \"text\" string."), 400
+
+    document = documents.get(document_id)
+    if document is None:
+        return jsonify(error="Unknown document."), 404
+
+    try:
+        patch = document.apply_edit(start, end, text)
+    except ValueError as error:
+        return jsonify(error_details(error)), error_status(error)
+
+    return jsonify(patch)
+
+@app.route('/api/documents/<document_id>', methods=['DELETE'])
+def delete_document(document_id):
+    documents.delete(document_id)
+    return '', 204